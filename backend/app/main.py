@@ -1,8 +1,35 @@
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from .routers import problems, submissions, gemini
+from .services import warmup
+from .services.evaluation_pool import evaluation_pool
+from .services.genai_client import close_genai_client
+from .services.sandbox import sandbox_pool
+
+WARMUP_ON_STARTUP = os.environ.get("WARMUP_ON_STARTUP", "1") != "0"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WARMUP_ON_STARTUP:
+        # Load the similarity model off the event loop so startup isn't blocked
+        warmup.start_warmup(c["expected_output"] for c in problems.CHALLENGES)
+    else:
+        warmup.skip_warmup()
+    # Scoring jobs are functions of the submissions router; workers import it up front
+    evaluation_pool.start(preload=[submissions.__name__])
+    sandbox_pool.start()
+    yield
+    evaluation_pool.shutdown()
+    sandbox_pool.shutdown()
+    await close_genai_client()
 
-app = FastAPI(title="PromptArena API", version="1.0.0")
+
+app = FastAPI(title="PromptArena API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,4 +46,11 @@ app.include_router(gemini.router)
 
 @app.get("/")
 def root():
-    return {"message": "Welcome to PromptArena API", "status": "running"}
\ No newline at end of file
+    return {"message": "Welcome to PromptArena API", "status": "running"}
+
+
+@app.get("/ready")
+def ready():
+    """Readiness probe: 503 until the similarity model has been warmed up"""
+    status = warmup.readiness()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
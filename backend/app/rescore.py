@@ -0,0 +1,48 @@
+"""
+Offline rescoring of submission history.
+
+    python -m app.rescore submissions.ndjson -o rescored.ndjson --rule-weight 0.5 --similarity-weight 0.5
+
+Reads NDJSON (one /submissions/create body per line, "-" for stdin) and
+writes one result per line, scoring in chunks through the same batched
+path as POST /submissions/batch.
+"""
+import argparse
+import json
+import sys
+
+from .routers.submissions import CHALLENGES
+from .services.evaluation import RULE_WEIGHT, SIMILARITY_WEIGHT
+from .services.rescoring import DEFAULT_CHUNK_SIZE, rescore_bytes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rescore submissions from an NDJSON file")
+    parser.add_argument("input", nargs="?", default="-", help="NDJSON input file, - for stdin")
+    parser.add_argument("-o", "--output", default="-", help="NDJSON output file, - for stdout")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--rule-weight", type=float, default=RULE_WEIGHT)
+    parser.add_argument("--similarity-weight", type=float, default=SIMILARITY_WEIGHT)
+    args = parser.parse_args(argv)
+
+    source = sys.stdin.buffer if args.input == "-" else open(args.input, "rb")
+    target = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    scored = errors = 0
+    try:
+        for result in rescore_bytes(source, CHALLENGES, max(1, args.chunk_size), args.rule_weight, args.similarity_weight):
+            target.write(json.dumps(result) + "\n")
+            if "error" in result:
+                errors += 1
+            else:
+                scored += 1
+    finally:
+        if source is not sys.stdin.buffer:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+    print(f"Rescored {scored} submissions, {errors} invalid lines", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
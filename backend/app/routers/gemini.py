@@ -1,12 +1,117 @@
-from fastapi import APIRouter, HTTPException
+from contextlib import AsyncExitStack
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-import base64
+from typing import AsyncIterator, Optional
+import anyio
 import os
+import time
+import unicodedata
 from google import genai
 from google.genai import types
 
+from ..services.blob_store import BlobStore, iter_range, parse_range, sniff_media_type
+from ..services.genai_client import get_genai_client, model_limiter
+from ..services.model_chain import ModelChain, ModelsUnavailable, models_from_env
+from ..services.result_cache import ResultCache, make_key
+from ..services.single_flight import SingleFlight
+from ..services.sse import sse_event
+
 router = APIRouter(prefix="/gemini", tags=["gemini"])
 
+# Tried in order; a model whose circuit breaker is open is skipped
+TEXT_MODELS = tuple(models_from_env("GEMINI_TEXT_MODELS", "gemini-1.5-flash,gemini-pro"))
+IMAGE_MODELS = tuple(models_from_env("GEMINI_IMAGE_MODELS", "imagen-3.0-generate-001,imagen-2.0-generate-001"))
+text_chain = ModelChain(TEXT_MODELS)
+image_chain = ModelChain(IMAGE_MODELS)
+# Sent with every text call; part of the cache key so changing it invalidates cached texts
+TEXT_GENERATION_CONFIG = None
+
+# Learners on the same challenge send near-identical prompts; repeats are answered from here
+text_cache = ResultCache(
+    max_entries=int(os.environ.get("GEMINI_CACHE_SIZE", "4096")),
+    ttl_seconds=float(os.environ.get("GEMINI_CACHE_TTL", "3600")),
+    db_path=os.environ.get("GEMINI_CACHE_DB") or None,
+    namespace="generate_text",
+)
+
+# Identical prompts arriving together (a class starting the same challenge) share one upstream call
+text_flights = SingleFlight()
+image_flights = SingleFlight()
+
+# Generated images are served from here by URL rather than inlined as base64
+image_store = BlobStore(
+    os.environ.get("IMAGE_STORE_DIR")
+    or os.path.join(os.path.dirname(__file__), "..", "..", "data", "images"),
+    max_bytes=int(float(os.environ.get("IMAGE_STORE_MAX_MB", "512")) * 1024 * 1024),
+)
+# A stored image never changes, so browsers and proxies may keep it forever
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def genai_client() -> genai.Client:
+    """The shared client; override this dependency to swap in a fake"""
+    try:
+        return get_genai_client()
+    except ValueError as e:  # no API key configured
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def generate_content(client: genai.Client, model: str, prompt: str):
+    """One non-blocking upstream call, queued behind the model's concurrency limit"""
+    async with model_limiter.slot(model):
+        return await client.aio.models.generate_content(model=model, contents=prompt, config=TEXT_GENERATION_CONFIG)
+
+
+async def generate_images(client: genai.Client, model: str, prompt: str):
+    async with model_limiter.slot(model):
+        return await client.aio.models.generate_images(
+            model=model,
+            prompt=prompt,
+            config=types.GenerateImagesConfig(
+                number_of_images=1,
+            )
+        )
+
+
+async def next_chunk(stream):
+    """The stream's next chunk, None once it's exhausted (builtin anext needs 3.10)"""
+    try:
+        return await stream.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def open_text_stream(client: genai.Client, model: str, prompt: str):
+    """
+    Start a streamed completion and wait for its first chunk, so a model that
+    fails up front still falls back. Returns (exit stack, stream, first chunk
+    or None); closing the stack closes the upstream stream and frees the slot.
+    """
+    stack = AsyncExitStack()
+    try:
+        await stack.enter_async_context(model_limiter.slot(model))
+        stream = await client.aio.models.generate_content_stream(
+            model=model, contents=prompt, config=TEXT_GENERATION_CONFIG
+        )
+        stack.push_async_callback(stream.aclose)
+        first = await next_chunk(stream)
+    except BaseException:
+        await stack.aclose()
+        raise
+    return stack, stream, first
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Prompts differing only in Unicode form or whitespace get the same completion"""
+    return " ".join(unicodedata.normalize("NFC", prompt).split())
+
+
+def text_cache_key(prompt: str) -> str:
+    return make_key(TEXT_MODELS, TEXT_GENERATION_CONFIG, normalize_prompt(prompt))
+
+
 class ImageGenerationRequest(BaseModel):
     prompt: str
 
@@ -14,89 +119,216 @@ class TextGenerationRequest(BaseModel):
     prompt: str
 
 @router.post("/generate-text")
-async def generate_text(request: TextGenerationRequest):
+async def generate_text(
+    request: TextGenerationRequest,
+    response: Response,
+    cache_control: Optional[str] = Header(None),
+    client: genai.Client = Depends(genai_client),
+):
+    """
+    Cached by normalized prompt. A request with `Cache-Control: no-cache`
+    skips the lookup (the fresh text still replaces the cached one) and
+    `no-store` bypasses the cache entirely. X-Cache reports HIT, MISS or BYPASS.
+    Misses for the same prompt that arrive together share one upstream call.
+    """
+    bypass, store = cache_policy(cache_control)
+    cache_key = text_cache_key(request.prompt)
+    if not bypass:
+        cached = text_cache.get(cache_key)
+        if cached is not None:
+            response.headers["X-Cache"] = "HIT"
+            return cached
+
+    result = await text_flights.do(cache_key, lambda: complete_text(client, request.prompt))
+    if store:
+        text_cache.set(cache_key, result)
+    response.headers["X-Cache"] = "BYPASS" if bypass else "MISS"
+    return result
+
+
+def cache_policy(cache_control: Optional[str]):
+    """(skip the lookup, store the result) for a request's Cache-Control header"""
+    directives = {d.strip().lower() for d in (cache_control or "").split(",")}
+    return "no-cache" in directives or "no-store" in directives, "no-store" not in directives
+
+
+def opaque_tag(tag: str) -> str:
+    """An If-None-Match entry without its weak prefix, for weak comparison"""
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+stream_stats = {"streams": 0, "completed": 0, "cancelled": 0, "failed": 0, "ttft_ms_total": 0.0}
+
+
+@router.post("/generate-text/stream")
+async def stream_text(
+    request: TextGenerationRequest,
+    cache_control: Optional[str] = Header(None),
+    client: genai.Client = Depends(genai_client),
+):
+    """
+    /generate-text as server-sent events: a "chunk" event per upstream chunk
+    as it arrives, then "done" with the assembled generated_text (cached like
+    /generate-text, so scoring can reuse it), or "error". A client that
+    disconnects cancels the upstream stream.
+    """
+    bypass, store = cache_policy(cache_control)
+    cache_key = text_cache_key(request.prompt)
+    cached = None if bypass else text_cache.get(cache_key)
+    return StreamingResponse(
+        text_events(client, request.prompt, cached, cache_key if store else None),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+            "X-Cache": "HIT" if cached is not None else "BYPASS" if bypass else "MISS",
+        },
+    )
+
+
+async def text_events(
+    client: genai.Client, prompt: str, cached: Optional[dict], cache_key: Optional[str]
+) -> AsyncIterator[str]:
+    if cached is not None:
+        yield sse_event("chunk", {"text": cached["generated_text"]})
+        yield sse_event("done", {**cached, "ttft_ms": 0.0})
+        return
+
+    started = time.monotonic()
+    stream_stats["streams"] += 1
     try:
-        # Use user-provided API key
-        API_KEY = os.environ.get("model_api")
-        client = genai.Client(api_key=API_KEY)
-
-        # Simply try one widely supported model first without nested try/catch hell
-        # 'gemini-1.5-flash' is the safest bet for new keys
-        response = client.models.generate_content(
-            model='gemini-1.5-flash',
-            contents=request.prompt
-        )
-        
-        return {
-            "generated_text": response.text
-        }
+        model, (stack, stream, chunk) = await text_chain.call(lambda model: open_text_stream(client, model, prompt))
     except Exception as e:
-        # If that fails, let's try 'gemini-pro' (1.0)
-        print(f"First attempt failed: {e}")
-        try:
-             client = genai.Client(api_key=API_KEY)
-             response = client.models.generate_content(
-                model='gemini-pro',
-                contents=request.prompt
-            )
-             return {
-                "generated_text": response.text
-            }
-        except Exception as e2:
-             print(f"Second attempt failed: {e2}")
-             raise HTTPException(status_code=500, detail=f"Generation failed: {str(e2)}")
+        stream_stats["failed"] += 1
+        status = 503 if isinstance(e, ModelsUnavailable) else 500
+        yield sse_event("error", {"status": status, "detail": f"Generation failed: {str(e)}"})
+        return
+
+    ttft_ms = round((time.monotonic() - started) * 1000, 2)
+    stream_stats["ttft_ms_total"] += ttft_ms
+    parts = []
+    try:
+        while chunk is not None:
+            if chunk.text:
+                parts.append(chunk.text)
+                yield sse_event("chunk", {"text": chunk.text})
+            chunk = await next_chunk(stream)
+    except Exception as e:
+        stream_stats["failed"] += 1
+        yield sse_event("error", {"status": 500, "detail": f"Generation failed: {str(e)}"})
+        return
+    except BaseException:
+        # Cancelled because the client went away
+        stream_stats["cancelled"] += 1
+        raise
+    finally:
+        # Runs under a cancelled scope on disconnect; shield it so the upstream really closes
+        with anyio.CancelScope(shield=True):
+            await stack.aclose()
+
+    result = {"generated_text": "".join(parts)}
+    if cache_key is not None:
+        text_cache.set(cache_key, result)
+    stream_stats["completed"] += 1
+    yield sse_event("done", {**result, "model": model, "ttft_ms": ttft_ms})
+
+
+async def complete_text(client: genai.Client, prompt: str) -> dict:
+    try:
+        _, response = await text_chain.call(lambda model: generate_content(client, model, prompt))
+    except ModelsUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Generation failed: {str(e)}")
+    return {
+        "generated_text": response.text
+    }
+
+async def create_image(client: genai.Client, prompt: str) -> str:
+    """Generate an image and store it; returns its digest in image_store"""
+    _, response = await image_chain.call(lambda model: generate_images(client, model, prompt))
+
+    if not response.generated_images:
+         raise HTTPException(status_code=500, detail="No image generated")
+
+    # Get the first image bytes
+    image_bytes = response.generated_images[0].image.image_bytes
+
+    return await run_in_threadpool(image_store.put, image_bytes)
+
 
 @router.post("/generate-image")
-async def generate_image(request: ImageGenerationRequest):
+async def generate_image(
+    request: ImageGenerationRequest, http_request: Request, client: genai.Client = Depends(genai_client)
+):
     try:
-        # Use user-provided API key
-        API_KEY = os.environ.get("MODEL_API")
-        
-        # Initialize GenAI Client
-        # Explicitly setting version to 'v1beta' if needed, though default is safer
-        client = genai.Client(api_key=API_KEY)
-        
-        try:
-            # Try Imagen 3 first
-            response = client.models.generate_images(
-                model='imagen-3.0-generate-001',
-                prompt=request.prompt,
-                config=types.GenerateImagesConfig(
-                    number_of_images=1,
-                )
-            )
-        except Exception:
-             # Fallback to Imagen 2 if 3 fails
-             print("Imagen 3 failed, trying fallback model...")
-             try:
-                 response = client.models.generate_images(
-                    model='imagen-2.0-generate-001', # Attempt fallback
-                    prompt=request.prompt,
-                    config=types.GenerateImagesConfig(
-                        number_of_images=1,
-                    )
-                 )
-             except:
-                  # Last resort fallback or re-raise original
-                  raise
-
-        if not response.generated_images:
-             raise HTTPException(status_code=500, detail="No image generated")
-
-        # Get the first image bytes
-        image_bytes = response.generated_images[0].image.image_bytes
-        
-        # Encode to base64 for frontend display
-        base64_image = base64.b64encode(image_bytes).decode('utf-8')
-        image_data_uri = f"data:image/png;base64,{base64_image}"
+        key = make_key(IMAGE_MODELS, normalize_prompt(request.prompt))
+        digest = await image_flights.do(key, lambda: create_image(client, request.prompt))
 
         return {
-            "image_url": image_data_uri,
+            "image_url": str(http_request.url_for("get_image", digest=digest)),
             "description": f"AI generated image based on: {request.prompt}",
             "generated_output_text": "Image generated successfully." 
         }
 
+    except ModelsUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         print(f"Error generating image: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@router.get("/images/{digest}", name="get_image")
+async def get_image(
+    digest: str,
+    range_header: Optional[str] = Header(None, alias="Range"),
+    if_none_match: Optional[str] = Header(None),
+    if_range: Optional[str] = Header(None),
+):
+    """A stored image, with its digest as a strong ETag and single byte-range support"""
+    f = await run_in_threadpool(image_store.open, digest)
+    if f is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if if_none_match and (
+        if_none_match.strip() == "*" or etag in (opaque_tag(tag) for tag in if_none_match.split(","))
+    ):
+        f.close()
+        return Response(status_code=304, headers=headers)
+
+    size = os.fstat(f.fileno()).st_size
+    media_type = sniff_media_type(await run_in_threadpool(f.read, 16))
+    if if_range is not None and if_range.strip() != etag:
+        range_header = None  # the client's partial copy is of something else; send it all
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        f.close()
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+
+    start, end = byte_range or (0, size - 1)
+    headers["Content-Length"] = str(end - start + 1)
+    if byte_range is not None:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    # A sync iterator, so Starlette reads the file in its threadpool
+    return StreamingResponse(
+        iter_range(f, start, end), status_code=206 if byte_range else 200, media_type=media_type, headers=headers
+    )
+
+
+@router.get("/stats")
+def get_gemini_stats():
+    return {
+        "models": model_limiter.stats(),
+        "breakers": {"text": text_chain.stats(), "image": image_chain.stats()},
+        "text_cache": text_cache.stats(),
+        "image_store": image_store.stats(),
+        "single_flight": {"text": text_flights.stats(), "image": image_flights.stats()},
+        "streams": {
+            **{key: value for key, value in stream_stats.items() if key != "ttft_ms_total"},
+            "ttft_ms_mean": round(stream_stats["ttft_ms_total"] / (stream_stats["streams"] - stream_stats["failed"]), 2)
+            if stream_stats["streams"] > stream_stats["failed"] else 0.0,
+        },
+    }
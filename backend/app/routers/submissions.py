@@ -1,10 +1,30 @@
-﻿from fastapi import APIRouter
+﻿from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, Dict, List, Optional, Union
+import asyncio
+import json
 import re
+from concurrent.futures.process import BrokenProcessPool
+
+from ..services.evaluation import RULE_WEIGHT, SIMILARITY_WEIGHT
+from ..services.evaluation_pool import PoolSaturated, evaluation_pool
+from ..services.lexical import STOP_WORDS, LexicalIndex, tokenize
+from ..services.llm_integration import (
+    evaluate_code_output,
+    execute_code_async,
+    execution_cache,
+    stream_code_execution,
+)
+from ..services.rescoring import DEFAULT_CHUNK_SIZE, rescore_stream
+from ..services.rule_engine import KeywordRuleSet, has_min_words
+from ..services.sse import sse_event
 
 router = APIRouter(prefix="/submissions", tags=["submissions"])
 
+# How often a running code execution checks whether its client is still there
+DISCONNECT_POLL_SECONDS = 0.5
+
 CHALLENGES = {
     1: {"expected_output": "A breathtaking golden sunset over a tropical beach with palm trees silhouetted against the orange and purple sky, gentle waves lapping at the sandy shore, warm golden light reflecting on the water", "module_type": "image"},
     2: {"expected_output": "A majestic snow-capped mountain perfectly reflected in a crystal clear alpine lake surrounded by pine trees under a bright blue sky with wispy clouds", "module_type": "image"},
@@ -23,6 +43,22 @@ CHALLENGES = {
 }
 
 
+class BodyStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that keeps reading the request body while it streams.
+    Starlette's version listens for disconnects on receive(), which would
+    swallow the body messages the generator is still waiting for.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        async for chunk in self.body_iterator:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode(self.charset)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
 class SubmissionRequest(BaseModel):
     challenge_id: int
     user_prompt: str
@@ -31,44 +67,56 @@ class SubmissionRequest(BaseModel):
     generated_image_description: Optional[str] = None
 
 
+class ExecutionRequest(BaseModel):
+    code: str
+    # JSON string (as stored on challenges) or a list of {"input", "expected"} objects
+    test_cases: Union[str, List[Dict[str, Any]]] = "[]"
+
+
+_RULES = KeywordRuleSet({
+    "role": ["you are", "act as", "imagine you", "as a", "role:", "pretend", "assume you are", "behave as"],
+    "format": ["format:", "output:", "write as", "in the form of", "structure:", "list", "bullet points",
+               "paragraph", "json", "markdown", "table", "step by step", "numbered"],
+    "constraints": ["must", "should", "limit", "maximum", "minimum", "at least", "no more than",
+                    "words", "sentences", "tone:", "style:", "formal", "casual", "professional",
+                    "within", "between", "exactly", "keep it", "short", "detailed", "brief"],
+    "audience": ["audience:", "for", "target", "reader", "user", "beginner", "expert", "student",
+                 "children", "developer", "customer", "client", "manager", "team"],
+})
+
+
 def rule_based_score(prompt):
     score = 0
     feedback = []
     improvements = []
 
-    role_keywords = ["you are", "act as", "imagine you", "as a", "role:", "pretend", "assume you are", "behave as"]
-    if any(kw in prompt.lower() for kw in role_keywords):
+    found = _RULES.find(prompt.lower())
+
+    if "role" in found:
         score += 2
         feedback.append("Role is specified in your prompt")
     else:
         improvements.append("Try assigning a role (e.g., You are a professional photographer...)")
 
-    format_keywords = ["format:", "output:", "write as", "in the form of", "structure:", "list", "bullet points",
-                        "paragraph", "json", "markdown", "table", "step by step", "numbered"]
-    if any(kw in prompt.lower() for kw in format_keywords):
+    if "format" in found:
         score += 2
         feedback.append("Output format is specified")
     else:
         improvements.append("Specify the desired output format (e.g., Write as a numbered list...)")
 
-    constraint_keywords = ["must", "should", "limit", "maximum", "minimum", "at least", "no more than",
-                           "words", "sentences", "tone:", "style:", "formal", "casual", "professional",
-                           "within", "between", "exactly", "keep it", "short", "detailed", "brief"]
-    if any(kw in prompt.lower() for kw in constraint_keywords):
+    if "constraints" in found:
         score += 2
         feedback.append("Constraints are specified (length/style/tone)")
     else:
         improvements.append("Add constraints like length, tone, or style (e.g., Keep it under 200 words, professional tone)")
 
-    if len(prompt.split()) >= 10:
+    if has_min_words(prompt, 10):
         score += 2
         feedback.append("Task is clearly described with enough detail")
     else:
         improvements.append("Describe the task more clearly with more detail (aim for at least 10 words)")
 
-    audience_keywords = ["audience:", "for", "target", "reader", "user", "beginner", "expert", "student",
-                         "children", "developer", "customer", "client", "manager", "team"]
-    if any(kw in prompt.lower() for kw in audience_keywords):
+    if "audience" in found:
         score += 2
         feedback.append("Audience or context is mentioned")
     else:
@@ -77,18 +125,19 @@ def rule_based_score(prompt):
     return score, feedback, improvements
 
 
+# Expected outputs tokenized once, keyed by challenge id
+EXPECTED_LEXICON = LexicalIndex({cid: c["expected_output"] for cid, c in CHALLENGES.items()})
+
+
 def simple_similarity_score(prompt, expected):
-    prompt_words = set(prompt.lower().split())
-    expected_words = set(expected.lower().split())
+    prompt_words = tokenize(prompt)
+    expected_words = tokenize(expected)
 
     if not expected_words:
         return 0
 
-    common_words = prompt_words.intersection(expected_words)
-    stop_words = {"a", "an", "the", "is", "are", "was", "were", "in", "on", "at", "to", "for",
-                  "of", "with", "and", "or", "but", "not", "this", "that", "it", "be", "as", "by"}
-    meaningful_common = common_words - stop_words
-    meaningful_expected = expected_words - stop_words
+    meaningful_common = (prompt_words & expected_words) - STOP_WORDS
+    meaningful_expected = expected_words - STOP_WORDS
 
     if not meaningful_expected:
         return 0
@@ -97,6 +146,13 @@ def simple_similarity_score(prompt, expected):
     return round(min(overlap_ratio * 10, 10), 1)
 
 
+def challenge_similarity_score(text, challenge_id):
+    """simple_similarity_score against a challenge's pre-tokenized expected output"""
+    if challenge_id not in EXPECTED_LEXICON:
+        return 0
+    return round(EXPECTED_LEXICON.score(text, challenge_id), 1)
+
+
 def generate_auto_help(prompt, challenge_id):
     challenge = CHALLENGES.get(challenge_id, {})
     module_type = challenge.get("module_type", "script")
@@ -121,12 +177,11 @@ def generate_auto_help(prompt, challenge_id):
     }
 
 
-@router.post("/create")
-def create_submission(submission: SubmissionRequest):
+def evaluate_submission(submission: SubmissionRequest):
+    """Score a submission; runs in the evaluation worker pool"""
     rule_score, feedback, improvements = rule_based_score(submission.user_prompt)
 
     challenge = CHALLENGES.get(submission.challenge_id, {})
-    expected = challenge.get("expected_output", "")
     module_type = challenge.get("module_type", "script")
 
     text_to_compare = ""
@@ -140,6 +195,14 @@ def create_submission(submission: SubmissionRequest):
              # Maybe check if user prompt itself has enough detail to score against expected?
              # For now, let's just use empty string which results in 0 similarity score
              text_to_compare = submission.user_prompt
+    elif module_type == "code":
+        text_to_compare = submission.generated_code or submission.generated_output
+    else:
+        text_to_compare = submission.generated_output
+
+    similarity = challenge_similarity_score(text_to_compare, submission.challenge_id)
+    final_score = round((rule_score * 0.4) + (similarity * 0.6), 1)
+
     auto_help = None
     if final_score < 2:
         auto_help = generate_auto_help(submission.user_prompt, submission.challenge_id)
@@ -156,9 +219,112 @@ def create_submission(submission: SubmissionRequest):
     }
 
 
+async def run_evaluation(fn, *args):
+    """Run CPU-bound scoring in the evaluation pool, shedding load when it is full"""
+    try:
+        return await evaluation_pool.run(fn, *args)
+    except PoolSaturated as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Scoring is busy, please retry shortly",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except BrokenProcessPool:
+        # A worker died mid-job; the pool starts fresh workers for the next request
+        raise HTTPException(
+            status_code=503,
+            detail="Scoring workers restarted, please retry",
+            headers={"Retry-After": "1"},
+        )
+
+
+@router.post("/create")
+async def create_submission(submission: SubmissionRequest):
+    return await run_evaluation(evaluate_submission, submission)
+
+
 @router.post("/score")
-def score_submission(submission: SubmissionRequest):
-    return create_submission(submission)
+async def score_submission(submission: SubmissionRequest):
+    return await create_submission(submission)
+
+
+@router.post("/batch")
+async def batch_rescore(
+    request: Request,
+    chunk_size: int = Query(DEFAULT_CHUNK_SIZE, ge=1, le=4096),
+    rule_weight: float = Query(RULE_WEIGHT, ge=0),
+    similarity_weight: float = Query(SIMILARITY_WEIGHT, ge=0),
+):
+    """
+    Rescore submissions sent as NDJSON (one /submissions/create body per line).
+    Results stream back as NDJSON in input order while the body is still being read.
+    """
+    return BodyStreamingResponse(
+        rescore_stream(request.stream(), CHALLENGES, chunk_size, rule_weight, similarity_weight),
+        media_type="application/x-ndjson",
+    )
+
+
+async def cancel_on_disconnect(request: Request, awaitable):
+    """Await `awaitable`, cancelling it (which kills its sandboxes) if the client goes away"""
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        task.cancel()
+
+
+@router.post("/execute")
+async def execute_submission_code(execution: ExecutionRequest, request: Request):
+    """Run submitted code against its test cases in the sandbox and score the pass rate"""
+    test_cases = execution.test_cases
+    if not isinstance(test_cases, str):
+        test_cases = json.dumps(test_cases)
+    results = await cancel_on_disconnect(request, execute_code_async(execution.code, test_cases))
+    return {**results, "score": evaluate_code_output(results)}
+
+
+@router.post("/execute/stream")
+async def stream_submission_code(execution: ExecutionRequest):
+    """
+    /submissions/execute as server-sent events: a "case" event with each
+    test case's details entry as soon as it finishes (in completion order),
+    then a "summary" event with the totals and score. A client that
+    disconnects stops the stream, which kills the sandboxes still running.
+    """
+    test_cases = execution.test_cases
+    if not isinstance(test_cases, str):
+        test_cases = json.dumps(test_cases)
+
+    async def events():
+        async for event, data in stream_code_execution(execution.code, test_cases):
+            if event == "summary":
+                # Every details entry has already been sent as a case event
+                data = {key: value for key, value in data.items() if key != "details"}
+                data["score"] = evaluate_code_output(data)
+            yield sse_event(event, data)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        # Proxies must pass each event through as soon as it is written
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/execute/cache")
+def get_execution_cache_stats():
+    return execution_cache.stats()
+
+
+@router.get("/pool")
+def get_pool_stats():
+    return evaluation_pool.stats()
 
 
 @router.get("/")
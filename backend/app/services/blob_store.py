@@ -0,0 +1,168 @@
+"""
+Content-addressed blob store on local disk.
+
+A blob lives at <root>/<aa>/<bb>/<sha256 hex>, named by the SHA-256 of its
+bytes, so storing the same bytes twice is free and a blob never changes
+once written (it can be cached forever and its digest is its ETag). Once
+the store grows past `max_bytes` the least recently read or written blobs
+are deleted.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from typing import Iterator, Optional, Tuple
+
+DIGEST_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+READ_CHUNK_SIZE = 64 * 1024
+
+# Eviction frees down to this fraction of max_bytes, so it doesn't rescan on every write
+EVICTION_LOW_WATER = 0.9
+
+# Magic numbers of the formats the image models return
+MEDIA_TYPES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"RIFF", "image/webp"),
+    (b"GIF8", "image/gif"),
+)
+
+
+def sniff_media_type(head: bytes) -> str:
+    for magic, media_type in MEDIA_TYPES:
+        if head.startswith(magic):
+            return media_type
+    return "application/octet-stream"
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    The inclusive (start, end) of a single `bytes=` range, None to send the
+    whole blob (no header, or one we don't handle such as multiple ranges).
+    Raises ValueError if the range lies outside the blob.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        else:  # suffix range: the last N bytes
+            start, end = max(0, size - int(last)), size - 1
+    except ValueError:  # malformed, so ignored
+        return None
+    if start < 0 or start >= size or start > end:
+        raise ValueError(f"Unsatisfiable range {header!r} for {size} bytes")
+    return start, end
+
+
+class BlobStore:
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size: Optional[int] = None  # scanned on first use
+        self.writes = 0
+        self.dedup_hits = 0
+        self.evictions = 0
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def _blobs(self) -> Iterator[os.DirEntry]:
+        if not os.path.isdir(self.root):
+            return
+        for shard in os.scandir(self.root):
+            if shard.is_dir():
+                for subshard in os.scandir(shard.path):
+                    if subshard.is_dir():
+                        yield from (e for e in os.scandir(subshard.path) if DIGEST_PATTERN.match(e.name))
+
+    def _total_size(self) -> int:
+        if self._size is None:
+            self._size = sum(entry.stat().st_size for entry in self._blobs())
+        return self._size
+
+    def put(self, data: bytes) -> str:
+        """Store `data` and return its digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        with self._lock:
+            if os.path.exists(path):
+                os.utime(path)
+                self.dedup_hits += 1
+                return digest
+            size = self._total_size()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so readers never see a partial blob
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            self._size = size + len(data)
+            self.writes += 1
+            self._evict(keep=digest)
+        return digest
+
+    def open(self, digest: str):
+        """The blob opened for binary reading, or None if it isn't stored"""
+        if not DIGEST_PATTERN.match(digest):
+            return None
+        path = self.path(digest)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            # Reads count as use for eviction
+            os.utime(path)
+        except OSError:
+            pass
+        return f
+
+    def _evict(self, keep: str):
+        if self._size <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICTION_LOW_WATER
+        entries = sorted(
+            ((entry.stat(), entry) for entry in self._blobs() if entry.name != keep),
+            key=lambda item: item[0].st_mtime,
+        )
+        for stat, entry in entries:
+            if self._size <= target:
+                break
+            try:
+                os.unlink(entry.path)
+            except FileNotFoundError:
+                continue
+            self._size -= stat.st_size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._total_size()
+        return {
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "writes": self.writes,
+            "dedup_hits": self.dedup_hits,
+            "evictions": self.evictions,
+        }
+
+
+def iter_range(f, start: int, end: int) -> Iterator[bytes]:
+    """Bytes start..end (inclusive) of an open blob, in chunks; closes it when done"""
+    with f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
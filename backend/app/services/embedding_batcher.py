@@ -0,0 +1,118 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+EncodeFn = Callable[[List[str]], np.ndarray]
+
+
+class EmbeddingBatcher:
+    """
+    Merges concurrent encode requests into batched model calls.
+
+    Callers hand their texts to `submit` (or the blocking `encode`) and get
+    back their own rows. A single worker thread drains the queue, waiting at
+    most `max_wait_ms` after the first request for more to arrive, and stops
+    collecting once `max_batch_size` texts are pending.
+    """
+
+    def __init__(self, encode: EncodeFn, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self._encode = encode
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: "queue.Queue[Optional[Tuple[List[str], Future]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.batches = 0
+        self.texts = 0
+        self.largest_batch = 0
+
+    def submit(self, texts: List[str]) -> Future:
+        future: Future = Future()
+        if not texts:
+            future.set_result(np.empty((0, 0), dtype=np.float32))
+            return future
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Embedding batcher is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._thread.start()
+        self._queue.put((list(texts), future))
+        return future
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        return self.submit(texts).result()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "texts": self.texts,
+            "largest_batch": self.largest_batch,
+            "average_batch": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+    def _collect(self, first: Tuple[List[str], Future]) -> Tuple[List[Tuple[List[str], Future]], bool]:
+        batch = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+            size += len(item[0])
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stop = self._collect(first)
+            requests = [(texts, future) for texts, future in batch if future.set_running_or_notify_cancel()]
+            if not requests:
+                continue
+
+            texts = [text for request_texts, _ in requests for text in request_texts]
+            self.batches += 1
+            self.texts += len(texts)
+            self.largest_batch = max(self.largest_batch, len(texts))
+            try:
+                embeddings = np.asarray(self._encode(texts))
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for request_texts, future in requests:
+                future.set_result(embeddings[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+        # Fail anything that raced with close() instead of leaving it waiting
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and item[1].set_running_or_notify_cancel():
+                item[1].set_exception(RuntimeError("Embedding batcher is closed"))
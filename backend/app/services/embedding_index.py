@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+EncodeFn = Callable[[List[str]], np.ndarray]
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize each row, leaving all-zero rows untouched"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[np.newaxis, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class EmbeddingIndex:
+    """
+    Disk-persisted store of normalized embeddings keyed by content hash.
+
+    Vectors live in `<name>.npy` and are opened memory-mapped; `<name>.json`
+    maps each content hash to its row. The store is tied to one model name,
+    so switching models discards it instead of mixing vector spaces.
+    """
+
+    def __init__(self, directory: str, model_name: str, name: str = "expected_outputs"):
+        self.directory = directory
+        self.model_name = model_name
+        self.vectors_path = os.path.join(directory, f"{name}.npy")
+        self.meta_path = os.path.join(directory, f"{name}.json")
+        self._lock = threading.Lock()
+        # (hash -> row, vectors) swapped as one tuple so readers never pair
+        # rows from one generation with vectors from another
+        self._state: tuple = ({}, None)
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._state[0])
+
+    def __contains__(self, text: str) -> bool:
+        return content_hash(text) in self._state[0]
+
+    def _load(self):
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("model") != self.model_name:
+                return
+            vectors = np.load(self.vectors_path, mmap_mode="r")
+            rows = meta.get("rows", {})
+            if len(rows) != vectors.shape[0]:
+                return
+            self._state = (rows, vectors)
+        except (OSError, ValueError):
+            self._state = ({}, None)
+
+    def _save(self, rows: Dict[str, int], vectors: np.ndarray):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_vectors = self.vectors_path + ".tmp.npy"
+        tmp_meta = self.meta_path + ".tmp"
+        np.save(tmp_vectors, vectors.astype(np.float32))
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "dim": int(vectors.shape[1]), "rows": rows}, f)
+        # Drop the mapping first, Windows refuses to replace a mapped file
+        self._state = ({}, None)
+        os.replace(tmp_vectors, self.vectors_path)
+        os.replace(tmp_meta, self.meta_path)
+        self._state = (rows, np.load(self.vectors_path, mmap_mode="r"))
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        rows, vectors = self._state
+        row = rows.get(content_hash(text))
+        if row is None or vectors is None:
+            return None
+        return np.asarray(vectors[row])
+
+    def build(self, texts: Iterable[str], encode: EncodeFn) -> int:
+        """
+        Make the store hold exactly `texts`.
+        Only texts without a stored vector are encoded; returns how many were.
+        """
+        wanted = {}
+        for text in texts:
+            if text:
+                wanted.setdefault(content_hash(text), text)
+        if not wanted:
+            return 0
+
+        with self._lock:
+            missing = [key for key in wanted if key not in self._state[0]]
+            if not missing and set(self._state[0]) == set(wanted):
+                return 0
+            self._rebuild(wanted, missing, encode)
+        return len(missing)
+
+    def lookup(self, text: str, encode: EncodeFn) -> np.ndarray:
+        """The stored vector for `text`, else a freshly encoded one"""
+        return self.lookup_many([text], encode)[text]
+
+    def lookup_many(self, texts: Iterable[str], encode: EncodeFn) -> Dict[str, np.ndarray]:
+        """
+        Vectors for `texts`: stored ones as they are, the rest encoded in a
+        single call. Those aren't persisted; the store only holds what
+        build() was given, so ad-hoc texts can't grow it without bound.
+        """
+        vectors = {}
+        missing = []
+        for text in dict.fromkeys(texts):
+            vector = self.get(text)
+            if vector is None:
+                missing.append(text)
+            else:
+                vectors[text] = vector
+        if missing:
+            vectors.update(zip(missing, normalize_rows(encode(missing))))
+        return vectors
+
+    def _rebuild(self, wanted: Dict[str, Optional[str]], missing: List[str], encode: EncodeFn):
+        fresh = {}
+        if missing:
+            encoded = normalize_rows(encode([wanted[key] for key in missing]))
+            fresh = dict(zip(missing, encoded))
+
+        rows, stored = self._state
+        keys = list(wanted)
+        vectors = np.stack([
+            fresh[key] if key in fresh else np.asarray(stored[rows[key]])
+            for key in keys
+        ])
+        del stored
+        self._save({key: i for i, key in enumerate(keys)}, vectors)
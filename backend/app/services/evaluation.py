@@ -1,23 +1,109 @@
+import os
 import re
-from typing import Tuple, List
+import threading
+from typing import Dict, Iterable, Tuple, List
 import numpy as np
 
+from .embedding_batcher import EmbeddingBatcher
+from .embedding_index import EmbeddingIndex, normalize_rows
+from .inference_backends import SIMILARITY_BACKEND, load_similarity_encoder
+from .lexical import LexicalIndex
+from .result_cache import ResultCache, make_key
+from .rule_engine import KeywordRuleSet, has_min_words
+
+SIMILARITY_MODEL_NAME = 'all-MiniLM-L6-v2'
+# Bump whenever scoring rules, weights or feedback change to invalidate cached results
+SCORER_VERSION = "1"
+# Final score = rule score * RULE_WEIGHT + similarity score * SIMILARITY_WEIGHT
+RULE_WEIGHT = 0.4
+SIMILARITY_WEIGHT = 0.6
+EMBEDDING_INDEX_DIR = os.environ.get(
+    "EMBEDDING_INDEX_DIR",
+    os.path.join(os.path.dirname(__file__), "..", "..", "data", "embeddings"),
+)
+EMBEDDING_MAX_BATCH_SIZE = int(os.environ.get("EMBEDDING_MAX_BATCH_SIZE", "32"))
+EMBEDDING_MAX_WAIT_MS = float(os.environ.get("EMBEDDING_MAX_WAIT_MS", "5"))
+
+# Identical resubmissions are answered from here instead of being rescored
+result_cache = ResultCache(
+    max_entries=int(os.environ.get("EVAL_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.environ.get("EVAL_CACHE_TTL", "3600")),
+    db_path=os.environ.get("EVAL_CACHE_DB") or None,
+    namespace="evaluate_prompt",
+)
+
 # Lazy load sentence transformers
 _model = None
+_model_backend = None
+_model_lock = threading.Lock()
+_batcher = None
+_expected_index = None
 
 def get_similarity_model():
-    """Lazy load the sentence transformer model"""
-    global _model
+    """Lazy load the sentence transformer model on the configured backend"""
+    global _model, _model_backend
     if _model is None:
-        try:
-            from sentence_transformers import SentenceTransformer
-            _model = SentenceTransformer('all-MiniLM-L6-v2')
-        except Exception as e:
-            print(f"Warning: Could not load sentence transformer: {e}")
-            _model = False  # Mark as failed
+        # Startup warm-up and early requests may race to load the model
+        with _model_lock:
+            if _model is None:
+                try:
+                    _model, _model_backend = load_similarity_encoder(SIMILARITY_MODEL_NAME)
+                except Exception as e:
+                    print(f"Warning: Could not load sentence transformer: {e}")
+                    _model = False  # Mark as failed
     return _model if _model is not False else None
 
 
+def get_similarity_backend():
+    """Backend the loaded model runs on (torch, onnx or onnx-int8), None if not loaded"""
+    return _model_backend
+
+
+def get_embedding_batcher():
+    """Lazy create the micro-batching encoder shared by all scoring calls"""
+    global _batcher
+    model = get_similarity_model()
+    if model is None:
+        return None
+    if _batcher is None:
+        _batcher = EmbeddingBatcher(model.encode, EMBEDDING_MAX_BATCH_SIZE, EMBEDDING_MAX_WAIT_MS)
+    return _batcher
+
+
+def get_expected_output_index() -> EmbeddingIndex:
+    """Lazy load the on-disk index of expected output embeddings"""
+    global _expected_index
+    if _expected_index is None:
+        # Backends produce slightly different vectors, keep them apart
+        backend = get_similarity_backend() or SIMILARITY_BACKEND
+        _expected_index = EmbeddingIndex(EMBEDDING_INDEX_DIR, f"{SIMILARITY_MODEL_NAME}:{backend}")
+    return _expected_index
+
+
+def build_expected_output_index(expected_outputs: Iterable[str]) -> int:
+    """
+    Precompute embeddings for every challenge's expected output.
+    Only new or changed texts are encoded; returns how many were.
+    """
+    model = get_similarity_model()
+    if model is None:
+        return 0
+    return get_expected_output_index().build(expected_outputs, model.encode)
+
+
+_RULES = KeywordRuleSet({
+    # Role (Act as, You are, As a, etc.)
+    "role": ['act as', 'you are', 'as a', 'as an', 'role:', 'persona:', 'you will be'],
+    "format": ['format:', 'output:', 'return', 'generate', 'write in', 'structure:', 'json', 'list', 'table', 'paragraph'],
+    # Constraints (length, style, tone)
+    "constraints": ['length:', 'words', 'characters', 'sentences', 'tone:', 'style:',
+                    'formal', 'informal', 'brief', 'detailed', 'maximum', 'minimum',
+                    'short', 'long', 'concise', 'verbose', 'professional', 'casual'],
+    "task_verb": ['create', 'write', 'generate', 'describe', 'explain', 'make'],
+    "audience": ['audience:', 'for', 'targeted at', 'context:', 'background:', 'scenario:', 'situation:', 'beginners', 'experts', 'students', 'professionals'],
+})
+
+
 def rule_based_score(prompt: str, challenge_type: str) -> Tuple[float, List[str]]:
     """
     Rule-based scoring (0-10)
@@ -30,45 +116,35 @@ def rule_based_score(prompt: str, challenge_type: str) -> Tuple[float, List[str]
     score = 0
     suggestions = []
     
-    prompt_lower = prompt.lower()
+    found = _RULES.find(prompt.lower())
     
-    # Check for role (Act as, You are, As a, etc.)
-    role_keywords = ['act as', 'you are', 'as a', 'as an', 'role:', 'persona:', 'you will be']
-    has_role = any(keyword in prompt_lower for keyword in role_keywords)
-    if has_role:
+    # Check for role
+    if "role" in found:
         score += 2
     else:
         suggestions.append("Consider specifying a role (e.g., 'Act as a...' or 'You are a...')")
     
     # Check for output format
-    format_keywords = ['format:', 'output:', 'return', 'generate', 'write in', 'structure:', 'json', 'list', 'table', 'paragraph']
-    has_format = any(keyword in prompt_lower for keyword in format_keywords)
-    if has_format:
+    if "format" in found:
         score += 2
     else:
         suggestions.append("Specify the desired output format (e.g., 'Format: bullet points' or 'Generate a JSON')")
     
     # Check for constraints (length, style, tone)
-    constraint_keywords = ['length:', 'words', 'characters', 'sentences', 'tone:', 'style:', 
-                          'formal', 'informal', 'brief', 'detailed', 'maximum', 'minimum',
-                          'short', 'long', 'concise', 'verbose', 'professional', 'casual']
-    has_constraints = any(keyword in prompt_lower for keyword in constraint_keywords)
-    if has_constraints:
+    if "constraints" in found:
         score += 2
     else:
         suggestions.append("Add constraints (e.g., 'Length: 200 words' or 'Tone: professional')")
     
     # Check for clear task description (length and specificity)
-    has_clear_task = len(prompt.split()) >= 10 and ('?' in prompt or any(verb in prompt_lower for verb in ['create', 'write', 'generate', 'describe', 'explain', 'make']))
+    has_clear_task = has_min_words(prompt, 10) and ('?' in prompt or "task_verb" in found)
     if has_clear_task:
         score += 2
     else:
         suggestions.append("Provide a clear and specific task description with action verbs")
     
     # Check for audience or context
-    audience_keywords = ['audience:', 'for', 'targeted at', 'context:', 'background:', 'scenario:', 'situation:', 'beginners', 'experts', 'students', 'professionals']
-    has_audience = any(keyword in prompt_lower for keyword in audience_keywords)
-    if has_audience:
+    if "audience" in found:
         score += 2
     else:
         suggestions.append("Mention the target audience or context (e.g., 'For beginners' or 'Context: business meeting')")
@@ -84,19 +160,18 @@ def similarity_score(generated_output: str, expected_output: str) -> float:
     if not expected_output or not generated_output:
         return 5.0  # Neutral score if no comparison possible
     
-    model = get_similarity_model()
-    if model is None:
+    batcher = get_embedding_batcher()
+    if batcher is None:
         # Fallback to simple keyword matching
         return keyword_similarity(generated_output, expected_output)
     
     try:
-        # Encode both texts
-        embeddings = model.encode([generated_output, expected_output])
+        # Expected outputs are fixed per challenge, only the generated text is encoded
+        expected_embedding = get_expected_output_index().lookup(expected_output, batcher.encode)
+        generated_embedding = normalize_rows(batcher.encode([generated_output]))[0]
         
-        # Calculate cosine similarity
-        similarity = np.dot(embeddings[0], embeddings[1]) / (
-            np.linalg.norm(embeddings[0]) * np.linalg.norm(embeddings[1])
-        )
+        # Calculate cosine similarity (both vectors are normalized)
+        similarity = np.dot(generated_embedding, expected_embedding)
         
         # Convert to 0-10 scale
         score = float(similarity) * 10
@@ -107,19 +182,44 @@ def similarity_score(generated_output: str, expected_output: str) -> float:
         return keyword_similarity(generated_output, expected_output)
 
 
+def similarity_scores_batch(generated_outputs: List[str], expected_outputs: List[str]) -> List[float]:
+    """
+    similarity_score for many (generated, expected) pairs at once:
+    one encode call for all generated outputs, one for the expected outputs
+    the index doesn't hold
+    """
+    scores = [5.0] * len(generated_outputs)  # Neutral score if no comparison possible
+    pairs = [i for i, (g, e) in enumerate(zip(generated_outputs, expected_outputs)) if g and e]
+    if not pairs:
+        return scores
+    generated = [generated_outputs[i] for i in pairs]
+    expected = [expected_outputs[i] for i in pairs]
+
+    batcher = get_embedding_batcher()
+    if batcher is not None:
+        try:
+            index = get_expected_output_index()
+            vectors = index.lookup_many(expected, batcher.encode)
+            expected_embeddings = np.stack([vectors[text] for text in expected])
+            generated_embeddings = normalize_rows(batcher.encode(generated))
+            similarities = np.sum(generated_embeddings * expected_embeddings, axis=1)
+            for i, similarity in zip(pairs, similarities):
+                scores[i] = max(0, min(10, float(similarity) * 10))
+            return scores
+        except Exception as e:
+            print(f"Error calculating batch similarity: {e}")
+
+    # Fallback to keyword matching, batched over this call's expected outputs only
+    # (a throwaway index, so ad-hoc texts don't pile up across calls)
+    lexicon = LexicalIndex({text: text for text in expected})
+    for i, score in zip(pairs, lexicon.score_pairs(generated, expected, "jaccard")):
+        scores[i] = float(score)
+    return scores
+
+
 def keyword_similarity(text1: str, text2: str) -> float:
-    """Fallback keyword-based similarity"""
-    words1 = set(text1.lower().split())
-    words2 = set(text2.lower().split())
-    
-    if not words1 or not words2:
-        return 0.0
-    
-    intersection = words1.intersection(words2)
-    union = words1.union(words2)
-    
-    jaccard = len(intersection) / len(union)
-    return jaccard * 10
+    """Fallback keyword-based similarity (Jaccard over word sets)"""
+    return LexicalIndex({text2: text2}).score(text1, text2, "jaccard")
 
 
 def evaluate_prompt(
@@ -132,15 +232,50 @@ def evaluate_prompt(
     Main evaluation function
     Returns evaluation result with score, feedback, and suggestions
     """
+    # Scores from the keyword fallback must not be served once the model is up
+    similarity_mode = get_similarity_backend() if get_similarity_model() is not None else "keyword"
+    cache_key = make_key(
+        SCORER_VERSION, similarity_mode, prompt, generated_output, expected_output, challenge_type,
+    )
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
     # Get rule-based score
     rule_score, suggestions = rule_based_score(prompt, challenge_type)
     
     # Get similarity score
     sim_score = similarity_score(generated_output, expected_output)
     
+    result = _build_result(rule_score, suggestions, sim_score, RULE_WEIGHT, SIMILARITY_WEIGHT)
+    result_cache.set(cache_key, result)
+    return result
+
+
+def evaluate_prompts_batch(
+    items: List[Dict],
+    rule_weight: float = RULE_WEIGHT,
+    similarity_weight: float = SIMILARITY_WEIGHT,
+) -> List[dict]:
+    """
+    evaluate_prompt for many submissions at once, with optional weights.
+    Each item has prompt, generated_output, expected_output and challenge_type;
+    similarity is computed with one batched encode for the whole list.
+    """
+    rules = [rule_based_score(item["prompt"], item.get("challenge_type", "general")) for item in items]
+    sim_scores = similarity_scores_batch(
+        [item.get("generated_output") or "" for item in items],
+        [item.get("expected_output") or "" for item in items],
+    )
+    return [
+        _build_result(rule_score, suggestions, sim_score, rule_weight, similarity_weight)
+        for (rule_score, suggestions), sim_score in zip(rules, sim_scores)
+    ]
+
+
+def _build_result(rule_score, suggestions, sim_score, rule_weight, similarity_weight) -> dict:
     # Calculate final score (weighted average)
-    # 40% rule-based, 60% similarity
-    final_score = (rule_score * 0.4) + (sim_score * 0.6)
+    final_score = (rule_score * rule_weight) + (sim_score * similarity_weight)
     final_score = round(final_score, 2)
     
     # Generate feedback
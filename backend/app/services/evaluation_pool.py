@@ -0,0 +1,201 @@
+import asyncio
+import importlib
+import math
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional, Sequence
+
+EVAL_POOL_WORKERS = int(os.environ.get("EVAL_POOL_WORKERS", str(os.cpu_count() or 1)))
+EVAL_POOL_QUEUE = int(os.environ.get("EVAL_POOL_QUEUE", "64"))
+
+
+class PoolSaturated(Exception):
+    """Raised when the evaluation queue is full; retry_after is in seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Evaluation queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _timed_call(fn: Callable, submitted_at: float, *args):
+    """Runs inside the worker; reports how long the job sat in the queue"""
+    started_at = time.time()
+    result = fn(*args)
+    return result, started_at - submitted_at, time.time() - started_at
+
+
+def _preload(modules: Sequence[str]):
+    """Worker initializer: import what jobs need before the first one arrives"""
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            print(f"Warning: evaluation worker could not preload {module}: {e}")
+
+
+def _noop():
+    return None
+
+
+def _shutdown_now(executor: Executor):
+    """Shut down without waiting, dropping queued jobs where Python can (3.9+)"""
+    if sys.version_info >= (3, 9):
+        executor.shutdown(wait=False, cancel_futures=True)
+    else:
+        executor.shutdown(wait=False)
+
+
+def _percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(math.ceil(fraction * len(ordered))) - 1)]
+
+
+class EvaluationPool:
+    """
+    Dedicated process pool for CPU-bound scoring with a bounded queue.
+
+    At most `workers + max_queue` jobs are admitted at once; beyond that
+    `submit` raises PoolSaturated so the endpoint can shed load quickly
+    instead of piling requests onto FastAPI's shared threadpool.
+    `workers=0` runs jobs on a single in-process thread instead.
+    """
+
+    def __init__(self, workers: int = EVAL_POOL_WORKERS, max_queue: int = EVAL_POOL_QUEUE):
+        self.workers = max(0, workers)
+        self.max_queue = max(0, max_queue)
+        self.capacity = max(1, self.workers) + self.max_queue
+        self._executor: Optional[Executor] = None
+        self._preload: Sequence[str] = ()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._waits = deque(maxlen=1000)
+        self._runs = deque(maxlen=1000)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.workers == 0:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="evaluation")
+            else:
+                # spawn: forking a server process that already runs threads can deadlock
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_preload,
+                    initargs=(tuple(self._preload),),
+                )
+        return self._executor
+
+    def start(self, preload: Sequence[str] = ()):
+        """
+        Spawn every worker now, each importing the `preload` modules, so the
+        first request doesn't pay for process spawn and the app import.
+        Doesn't wait for them.
+        """
+        with self._lock:
+            self._preload = tuple(preload)
+            executor = self._get_executor()
+        # Workers are spawned on demand, one per job finding none idle
+        for _ in range(max(1, self.workers)):
+            executor.submit(_noop)
+
+    def retry_after(self) -> int:
+        average_run = sum(self._runs) / len(self._runs) if self._runs else 1.0
+        return max(1, math.ceil(average_run * self._pending / max(1, self.workers)))
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """
+        Queue fn(*args). Raises PoolSaturated when the queue is full, and
+        BrokenProcessPool when a worker died; the pool is rebuilt on the next call.
+        """
+        with self._lock:
+            if self._pending >= self.capacity:
+                self.rejected += 1
+                raise PoolSaturated(self.retry_after())
+            executor = self._get_executor()
+            self._pending += 1
+        try:
+            inner = executor.submit(_timed_call, fn, time.time(), *args)
+        except Exception as e:
+            with self._lock:
+                self._pending -= 1
+            if isinstance(e, BrokenProcessPool):
+                self._discard(executor)
+            raise
+
+        outer: Future = Future()
+        inner.add_done_callback(lambda done: self._finish(executor, done, outer))
+        return outer
+
+    def _discard(self, executor: Executor):
+        """Drop a broken executor so the next submit starts a fresh one"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        _shutdown_now(executor)
+
+    def _finish(self, executor: Executor, inner: Future, outer: Future):
+        with self._lock:
+            self._pending -= 1
+        try:
+            result, waited, ran = inner.result()
+        except CancelledError:
+            outer.cancel()
+            return
+        except Exception as e:
+            self.failed += 1
+            if isinstance(e, BrokenProcessPool):
+                self._discard(executor)
+            # False if the caller cancelled it while it ran
+            if outer.set_running_or_notify_cancel():
+                outer.set_exception(e)
+            return
+        self.completed += 1
+        self._waits.append(waited)
+        self._runs.append(ran)
+        if outer.set_running_or_notify_cancel():
+            outer.set_result(result)
+
+    async def run(self, fn: Callable, *args):
+        """Submit from async code and await the result without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            _shutdown_now(executor)
+
+    def stats(self) -> dict:
+        waits, runs = list(self._waits), list(self._runs)
+        return {
+            "workers": self.workers,
+            "capacity": self.capacity,
+            "in_flight": self._pending,
+            "queue_depth": max(0, self._pending - max(1, self.workers)),
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_ms": {
+                "p50": round(_percentile(waits, 0.5) * 1000, 2),
+                "p95": round(_percentile(waits, 0.95) * 1000, 2),
+                "max": round(max(waits, default=0.0) * 1000, 2),
+            },
+            "run_ms": {
+                "p50": round(_percentile(runs, 0.5) * 1000, 2),
+                "p95": round(_percentile(runs, 0.95) * 1000, 2),
+            },
+        }
+
+
+evaluation_pool = EvaluationPool()
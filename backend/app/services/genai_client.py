@@ -0,0 +1,128 @@
+"""
+Process-wide Gemini client.
+
+Every request reuses one genai.Client, so calls share its pooled keep-alive
+connections instead of opening (and TLS-handshaking) a new one each time.
+The app's lifespan closes it on shutdown. Calls go through `client.aio` and
+take a slot from `model_limiter` first, so a slow model never blocks the
+event loop and never has more than GENAI_MODEL_CONCURRENCY calls in flight.
+"""
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+import httpx
+from google import genai
+from google.genai import types
+
+GENAI_MAX_CONNECTIONS = int(os.environ.get("GENAI_MAX_CONNECTIONS", "20"))
+GENAI_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("GENAI_MAX_KEEPALIVE_CONNECTIONS", "10"))
+GENAI_KEEPALIVE_EXPIRY = float(os.environ.get("GENAI_KEEPALIVE_EXPIRY", "30"))  # seconds an idle connection is kept
+GENAI_TIMEOUT = float(os.environ.get("GENAI_TIMEOUT", "60"))  # seconds per upstream call
+GENAI_BASE_URL = os.environ.get("GENAI_BASE_URL") or None  # e.g. a local stub server for load tests
+GENAI_MODEL_CONCURRENCY = int(os.environ.get("GENAI_MODEL_CONCURRENCY", "8"))  # in-flight calls per model
+
+_client: Optional[genai.Client] = None
+_client_lock = threading.Lock()
+
+
+def genai_api_key() -> Optional[str]:
+    # The image route has always read MODEL_API and the text route model_api
+    return os.environ.get("MODEL_API") or os.environ.get("model_api")
+
+
+def create_genai_client(api_key: Optional[str] = None) -> genai.Client:
+    """A client whose sync and async HTTP pools use the configured limits and timeout"""
+    limits = httpx.Limits(
+        max_connections=GENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=GENAI_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=GENAI_KEEPALIVE_EXPIRY,
+    )
+    return genai.Client(
+        api_key=api_key or genai_api_key(),
+        http_options=types.HttpOptions(
+            base_url=GENAI_BASE_URL,
+            timeout=int(GENAI_TIMEOUT * 1000),  # milliseconds
+            client_args={"limits": limits},
+            async_client_args={"limits": limits},
+        ),
+    )
+
+
+def get_genai_client() -> genai.Client:
+    """The shared client, created on first use; raises ValueError without an API key"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_genai_client()
+    return _client
+
+
+async def close_genai_client():
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
+        await client.aio.aclose()
+
+
+class ModelLimiter:
+    """
+    Caps in-flight upstream calls per model and records how long callers
+    queued for a slot.
+    """
+
+    def __init__(self, limit: int = GENAI_MODEL_CONCURRENCY):
+        self.limit = max(1, limit)
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._stats: Dict[str, dict] = {}
+
+    def _model(self, model: str):
+        if model not in self._semaphores:
+            self._semaphores[model] = asyncio.Semaphore(self.limit)
+            self._stats[model] = {
+                "in_flight": 0, "waiting": 0, "calls": 0, "queued": 0, "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+            }
+        return self._semaphores[model], self._stats[model]
+
+    @asynccontextmanager
+    async def slot(self, model: str) -> AsyncIterator[None]:
+        semaphore, stats = self._model(model)
+        started = time.monotonic()
+        # Calls that found every slot taken and had to queue
+        stats["queued"] += semaphore.locked()
+        stats["waiting"] += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            stats["waiting"] -= 1
+        waited_ms = (time.monotonic() - started) * 1000
+        stats["calls"] += 1
+        stats["wait_ms_total"] += waited_ms
+        stats["wait_ms_max"] = max(stats["wait_ms_max"], waited_ms)
+        stats["in_flight"] += 1
+        try:
+            yield
+        finally:
+            stats["in_flight"] -= 1
+            semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            model: {
+                **stats,
+                "limit": self.limit,
+                "wait_ms_total": round(stats["wait_ms_total"], 2),
+                "wait_ms_max": round(stats["wait_ms_max"], 2),
+                "wait_ms_mean": round(stats["wait_ms_total"] / stats["calls"], 2) if stats["calls"] else 0.0,
+            }
+            for model, stats in self._stats.items()
+        }
+
+
+model_limiter = ModelLimiter()
@@ -0,0 +1,146 @@
+import os
+from typing import Tuple
+
+import numpy as np
+
+# torch (SentenceTransformer) or onnx (onnxruntime, optionally int8 quantized)
+SIMILARITY_BACKEND = os.environ.get("SIMILARITY_BACKEND", "torch").lower()
+SIMILARITY_ONNX_QUANTIZE = os.environ.get("SIMILARITY_ONNX_QUANTIZE", "1") != "0"
+SIMILARITY_ONNX_DIR = os.environ.get(
+    "SIMILARITY_ONNX_DIR",
+    os.path.join(os.path.dirname(__file__), "..", "..", "data", "onnx"),
+)
+SIMILARITY_ONNX_THREADS = int(os.environ.get("SIMILARITY_ONNX_THREADS", "0"))  # 0 = onnxruntime default
+
+
+def hub_model_id(model_name: str) -> str:
+    """sentence-transformers resolves bare model names to its own organisation"""
+    return model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+
+
+class OnnxSentenceEncoder:
+    """
+    Runs a BERT-style sentence-transformers model through onnxruntime.
+
+    Mirrors the all-MiniLM pipeline: tokenize with truncation, mean-pool the
+    token embeddings over the attention mask and L2-normalize, so `encode`
+    is a drop-in for SentenceTransformer.encode.
+    """
+
+    def __init__(self, onnx_path: str, tokenizer_name: str, max_seq_length: int = 256, batch_size: int = 32):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if SIMILARITY_ONNX_THREADS > 0:
+            options.intra_op_num_threads = SIMILARITY_ONNX_THREADS
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        self.max_seq_length = max_seq_length
+        self.batch_size = batch_size
+
+    def encode(self, sentences, batch_size: int = None, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        batch_size = batch_size or self.batch_size
+
+        outputs = []
+        for start in range(0, len(sentences), batch_size):
+            batch = list(sentences[start:start + batch_size])
+            tokens = self.tokenizer(
+                batch, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np"
+            )
+            feed = {name: tokens[name].astype(np.int64) for name in self.input_names if name in tokens}
+            if "token_type_ids" in self.input_names and "token_type_ids" not in feed:
+                feed["token_type_ids"] = np.zeros_like(tokens["input_ids"], dtype=np.int64)
+            token_embeddings = self.session.run(None, feed)[0]
+
+            mask = tokens["attention_mask"].astype(np.float32)[:, :, np.newaxis]
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+            outputs.append(pooled / np.clip(norms, 1e-12, None))
+
+        embeddings = np.concatenate(outputs) if outputs else np.empty((0, 0), dtype=np.float32)
+        return embeddings[0] if single else embeddings
+
+
+def export_onnx(model_name: str, output_path: str):
+    """Export the transformer behind a sentence-transformers model to ONNX"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    model_id = hub_model_id(model_name)
+    tokenizer = AutoTokenizer.from_pretrained(model_id)
+    model = AutoModel.from_pretrained(model_id)
+    model.eval()
+
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            tmp_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=17,
+        )
+    os.replace(tmp_path, output_path)
+
+
+def quantize_onnx(input_path: str, output_path: str):
+    """int8 dynamic quantization of the weights, activations stay float"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    tmp_path = output_path + ".tmp"
+    quantize_dynamic(input_path, tmp_path, weight_type=QuantType.QInt8)
+    os.replace(tmp_path, output_path)
+
+
+def load_onnx_encoder(model_name: str, quantize: bool = SIMILARITY_ONNX_QUANTIZE) -> OnnxSentenceEncoder:
+    """Load (exporting and quantizing on first use) the ONNX version of `model_name`"""
+    model_dir = os.path.join(SIMILARITY_ONNX_DIR, model_name.replace("/", "__"))
+    onnx_path = os.path.join(model_dir, "model.onnx")
+    if not os.path.exists(onnx_path):
+        export_onnx(model_name, onnx_path)
+    if quantize:
+        quantized_path = os.path.join(model_dir, "model.int8.onnx")
+        if not os.path.exists(quantized_path):
+            quantize_onnx(onnx_path, quantized_path)
+        onnx_path = quantized_path
+    return OnnxSentenceEncoder(onnx_path, hub_model_id(model_name))
+
+
+def load_torch_encoder(model_name: str):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+
+def load_similarity_encoder(
+    model_name: str,
+    backend: str = SIMILARITY_BACKEND,
+    quantize: bool = SIMILARITY_ONNX_QUANTIZE,
+) -> Tuple[object, str]:
+    """
+    Load the encoder for the selected backend.
+    Returns (encoder, backend id); an unusable ONNX backend falls back to torch.
+    """
+    if backend == "onnx":
+        try:
+            encoder = load_onnx_encoder(model_name, quantize)
+            return encoder, "onnx-int8" if quantize else "onnx"
+        except Exception as e:
+            print(f"Warning: ONNX backend unavailable, falling back to torch: {e}")
+    elif backend != "torch":
+        print(f"Warning: Unknown similarity backend '{backend}', using torch")
+    return load_torch_encoder(model_name), "torch"
+
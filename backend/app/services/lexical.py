@@ -0,0 +1,119 @@
+import threading
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+STOP_WORDS = frozenset({
+    "a", "an", "the", "is", "are", "was", "were", "in", "on", "at", "to", "for",
+    "of", "with", "and", "or", "but", "not", "this", "that", "it", "be", "as", "by",
+})
+
+
+def tokenize(text: str) -> set:
+    return set(text.lower().split())
+
+
+class LexicalIndex:
+    """
+    Reference texts (challenge expected outputs) tokenized once into an
+    integer vocabulary, each kept as a sorted array of token ids.
+
+    Candidates are scored in batches against those id arrays, for two metrics:
+    - "overlap": share of the reference's non-stop-words found in the
+      candidate (submissions scoring)
+    - "jaccard": |intersection| / |union| of the two word sets (the
+      embedding-free fallback in evaluation)
+    Scores are on a 0-10 scale and unrounded. Adding a text costs only its
+    own tokens; nothing is rebuilt for the texts already in the index.
+    """
+
+    def __init__(self, references: Optional[Dict[Hashable, str]] = None):
+        self._lock = threading.Lock()
+        self._vocab: Dict[str, int] = {}
+        self._keys: Dict[Hashable, int] = {}
+        # (all words, non-stop words) of each reference
+        self._token_ids: List[Tuple[np.ndarray, np.ndarray]] = []
+        for key, text in (references or {}).items():
+            self.add(key, text)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._keys
+
+    def add(self, key: Hashable, text: str):
+        with self._lock:
+            ids, meaningful = [], []
+            for token in tokenize(text or ""):
+                if token not in self._vocab:
+                    self._vocab[token] = len(self._vocab)
+                ids.append(self._vocab[token])
+                if token not in STOP_WORDS:
+                    meaningful.append(self._vocab[token])
+            entry = (np.array(sorted(ids), dtype=np.int64), np.array(sorted(meaningful), dtype=np.int64))
+            if key in self._keys:
+                self._token_ids[self._keys[key]] = entry
+            else:
+                self._keys[key] = len(self._token_ids)
+                self._token_ids.append(entry)
+
+    def _references(self, keys: Sequence[Hashable], metric: str):
+        """The keys' token ids as flat (row, id) arrays, plus each one's word count"""
+        column = 1 if metric == "overlap" else 0
+        arrays = [self._token_ids[self._keys[key]][column] for key in keys]
+        counts = np.array([len(ids) for ids in arrays], dtype=np.float64)
+        rows = np.repeat(np.arange(len(arrays), dtype=np.int64), counts.astype(np.int64))
+        ids = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.int64)
+        return rows, ids, counts
+
+    def _candidates(self, texts: Sequence[str]):
+        """Known token ids of each candidate as flat (row, id) arrays, plus word-set sizes"""
+        vocab = self._vocab
+        rows: List[int] = []
+        ids: List[int] = []
+        counts = np.empty(len(texts), dtype=np.float64)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text or "")
+            counts[row] = len(tokens)
+            known = [i for i in map(vocab.get, tokens) if i is not None]
+            ids.extend(known)
+            rows.extend([row] * len(known))
+        return np.array(rows, dtype=np.int64), np.array(ids, dtype=np.int64), counts
+
+    @staticmethod
+    def _metric(intersection, candidate_counts, reference_counts, metric: str) -> np.ndarray:
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if metric == "overlap":
+                scores = np.minimum(intersection / reference_counts * 10, 10)
+                return np.where(reference_counts > 0, scores, 0.0)
+            if metric == "jaccard":
+                union = candidate_counts + reference_counts - intersection
+                scores = intersection / union * 10
+                return np.where((candidate_counts > 0) & (reference_counts > 0), scores, 0.0)
+        raise ValueError(f"Unknown lexical metric: {metric}")
+
+    def score_batch(self, texts: Sequence[str], keys: Sequence[Hashable], metric: str = "overlap") -> np.ndarray:
+        """Score every text against every reference key, shape (len(texts), len(keys))"""
+        key_rows, key_ids, reference_counts = self._references(keys, metric)
+        rows, ids, counts = self._candidates(texts)
+        # Incidence matrices over just the words these references use
+        columns = np.unique(key_ids)
+        reference = np.zeros((len(keys), len(columns)), dtype=np.float64)
+        reference[key_rows, np.searchsorted(columns, key_ids)] = 1.0
+        positions = np.minimum(np.searchsorted(columns, ids), max(len(columns) - 1, 0))
+        known = columns[positions] == ids if len(columns) else np.zeros(len(ids), dtype=bool)
+        incidence = np.zeros((len(texts), len(columns)), dtype=np.float64)
+        incidence[rows[known], positions[known]] = 1.0
+        intersection = incidence @ reference.T
+        return self._metric(intersection, counts[:, np.newaxis], reference_counts[np.newaxis, :], metric)
+
+    def score_pairs(self, texts: Sequence[str], keys: Sequence[Hashable], metric: str = "overlap") -> np.ndarray:
+        """Score texts[i] against keys[i] only, shape (len(texts),)"""
+        key_rows, key_ids, reference_counts = self._references(keys, metric)
+        rows, ids, counts = self._candidates(texts)
+        # Pair each id with its row so one membership test covers every pair
+        width = int(max(ids.max(initial=0), key_ids.max(initial=0))) + 1
+        hits = np.isin(rows * width + ids, key_rows * width + key_ids)
+        intersection = np.bincount(rows, weights=hits, minlength=len(texts))
+        return self._metric(intersection, counts, reference_counts, metric)
+
+    def score(self, text: str, key: Hashable, metric: str = "overlap") -> float:
+        return float(self.score_pairs([text], [key], metric)[0])
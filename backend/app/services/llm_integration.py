@@ -1,17 +1,321 @@
+import asyncio
+import os
 import subprocess
 import json
+import signal
 import sys
-from typing import Dict, List
+import time
+import traceback
+import warnings
+from functools import partial
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
-def execute_code_safely(code: str, test_cases: str, timeout: int = 5) -> Dict:
+from .result_cache import ResultCache, make_key
+from .sandbox import (
+    SANDBOX_CASE_PARALLELISM,
+    SANDBOX_SUBMISSION_TIMEOUT,
+    DeadlineExceeded,
+    afan_out,
+    fan_out,
+    sandbox_limits,
+    sandbox_pool,
+)
+from .sandbox_worker import CASE_SOURCE, SCRIPT_SOURCE
+
+# Bump whenever the test script or the verdict mapping changes to invalidate cached executions
+EXECUTOR_VERSION = "2"
+
+# Compiling submissions in this process must not print their SyntaxWarnings to the server log
+SUBMISSION_FILENAME = "<submission>"
+warnings.filterwarnings("ignore", category=SyntaxWarning, module=SUBMISSION_FILENAME)
+# Larger submissions are rejected unrun, before compiling them can eat the server's memory or stack
+SUBMISSION_MAX_BYTES = int(os.environ.get("SUBMISSION_MAX_BYTES", "100000"))
+
+# Resubmitted solutions are answered from here instead of rerunning every test case
+execution_cache = ResultCache(
+    max_entries=int(os.environ.get("EXEC_CACHE_SIZE", "1024")),
+    ttl_seconds=float(os.environ.get("EXEC_CACHE_TTL", "86400")),
+    db_path=os.environ.get("EXEC_CACHE_DB") or None,
+    namespace="execute_code",
+)
+
+
+def build_test_script(code: str, test_case: Dict) -> str:
+    """Standalone script running the user's code and one test case, printing a JSON verdict"""
+    return SCRIPT_SOURCE.format(code=repr(code)) + CASE_SOURCE.format(
+        input=json.dumps(test_case.get("input", {})), expected=json.dumps(test_case.get("expected", ""))
+    )
+
+
+def compile_submission(code: str) -> Optional[str]:
     """
-    Execute code in a restricted environment
-    Returns execution results
+    Compile the submitted code once, before any sandbox starts.
+    Returns the syntax diagnostic, or None when the code compiles.
+    """
+    size = len(code.encode("utf-8", "surrogatepass"))
+    if size > SUBMISSION_MAX_BYTES:
+        return f"Submission is too large: {size} bytes (limit {SUBMISSION_MAX_BYTES})"
+    try:
+        compile(code, SUBMISSION_FILENAME, "exec")
+    except (SyntaxError, ValueError) as e:  # ValueError: null bytes in the source
+        return "".join(traceback.format_exception_only(type(e), e)).rstrip()
+    except (RecursionError, MemoryError) as e:
+        # Expressions nested deeper than the compiler's own stack allows
+        return f"{type(e).__name__}: code is nested too deeply to compile"
+    return None
+
+
+def test_case_detail(i: int, test_case: Dict, result) -> Dict:
+    """
+    Turn one test case's outcome (CompletedProcess, TimeoutExpired or
+    another exception) into its `details` entry, with what the sandbox cost
+    under "usage" (wall_ms, cpu_ms, peak_rss_kb; None where unknown)
+    """
+    detail = _verdict(i, test_case, result)
+    detail["usage"] = getattr(result, "usage", None)
+    return detail
+
+
+def _signal_message(returncode: int) -> str:
+    if returncode == -signal.SIGXCPU:
+        return "CPU time limit exceeded"
+    try:
+        return f"Killed by {signal.Signals(-returncode).name}"
+    except ValueError:
+        return f"Killed by signal {-returncode}"
+
+
+def _verdict(i: int, test_case: Dict, result) -> Dict:
+    if isinstance(result, DeadlineExceeded):
+        return {
+            "test": i + 1,
+            "status": "timeout",
+            "message": "Submission time limit exceeded"
+        }
+    if isinstance(result, subprocess.TimeoutExpired):
+        return {
+            "test": i + 1,
+            "status": "timeout",
+            "message": "Execution timed out"
+        }
+    if isinstance(result, Exception):
+        return {
+            "test": i + 1,
+            "status": "error",
+            "message": str(result)
+        }
+
+    if result.returncode == 0:
+        try:
+            test_result = json.loads(result.stdout)
+            if test_result.get("match"):
+                return {
+                    "test": i + 1,
+                    "status": "passed",
+                    "input": test_case.get("input"),
+                    "expected": test_case.get("expected"),
+                    "actual": test_result.get("result")
+                }
+            else:
+                return {
+                    "test": i + 1,
+                    "status": "failed",
+                    "input": test_case.get("input"),
+                    "expected": test_result.get("expected"),
+                    "actual": test_result.get("result")
+                }
+        except:
+            return {
+                "test": i + 1,
+                "status": "error",
+                "message": result.stdout or result.stderr
+            }
+    else:
+        return {
+            "test": i + 1,
+            "status": "error",
+            "message": result.stderr or (_signal_message(result.returncode) if result.returncode < 0 else "")
+        }
+
+
+def _run_shard(code: str, test_cases_list: List[Dict], indexes: List[int], timeout: int, deadline: float):
+    """Run some of the test cases one after another in a single sandbox"""
+    if sandbox_pool.enabled:
+        cases = [test_cases_list[i] for i in indexes]
+        for j, result in sandbox_pool.run_suite(code, cases, timeout, deadline):
+            yield indexes[j], result
+        return
+
+    for i in indexes:
+        try:
+            # Execute with timeout
+            result = sandbox_pool.run(build_test_script(code, test_cases_list[i]), timeout, deadline)
+        except Exception as e:
+            result = e
+        yield i, result
+
+
+def iter_test_results(
+    code: str,
+    test_cases_list: List[Dict],
+    timeout: int = 5,
+    submission_timeout: float = SANDBOX_SUBMISSION_TIMEOUT,
+    parallelism: int = SANDBOX_CASE_PARALLELISM,
+) -> Iterator[Dict]:
+    """
+    Run every test case and yield its `details` entry as soon as it finishes.
+
+    Cases are split across up to `parallelism` sandboxes running at once.
+    With the sandbox pool each sandbox loads the user's module once and runs
+    its cases in forks of it; without it every case is a separate
+    `python -c` of the standalone test script. `timeout` applies per case,
+    `submission_timeout` to the whole run.
+    """
+    rejected, runnable = _split_malformed_cases(test_cases_list)
+    yield from rejected
+    if not runnable:
+        return
+    deadline = time.monotonic() + submission_timeout
+    shards = [
+        (indexes, partial(_run_shard, code, test_cases_list, indexes, timeout, deadline))
+        for indexes in _shard_indexes(runnable, parallelism)
+    ]
+    for i, result in fan_out(shards, deadline):
+        yield test_case_detail(i, test_cases_list[i], result)
+
+
+def _split_malformed_cases(test_cases_list: List[Dict]) -> Tuple[List[Dict], List[int]]:
+    """
+    Error entries for the test cases that aren't JSON objects, which never
+    reach a sandbox, and the indexes of the others
+    """
+    rejected, runnable = [], []
+    for i, test_case in enumerate(test_cases_list):
+        if isinstance(test_case, dict):
+            runnable.append(i)
+        else:
+            rejected.append(test_case_detail(i, {}, ValueError("Test case must be a JSON object")))
+    return rejected, runnable
+
+
+def _shard_indexes(indexes: List[int], parallelism: int) -> List[List[int]]:
+    # More shards than free sandboxes would only load the module more often
+    shard_count = max(1, min(parallelism, sandbox_pool.capacity, len(indexes)))
+    return [indexes[k::shard_count] for k in range(shard_count)]
+
+
+async def _run_shard_async(code: str, test_cases_list: List[Dict], indexes: List[int], timeout: int, deadline: float):
+    """_run_shard without blocking the event loop"""
+    if sandbox_pool.enabled:
+        cases = [test_cases_list[i] for i in indexes]
+        async for j, result in sandbox_pool.arun_suite(code, cases, timeout, deadline):
+            yield indexes[j], result
+        return
+
+    for i in indexes:
+        try:
+            result = await sandbox_pool.arun(build_test_script(code, test_cases_list[i]), timeout, deadline)
+        except Exception as e:
+            result = e
+        yield i, result
+
+
+async def aiter_test_results(
+    code: str,
+    test_cases_list: List[Dict],
+    timeout: int = 5,
+    submission_timeout: float = SANDBOX_SUBMISSION_TIMEOUT,
+    parallelism: int = SANDBOX_CASE_PARALLELISM,
+) -> AsyncIterator[Dict]:
+    """
+    iter_test_results for async callers. Nothing blocks the event loop, and
+    cancelling the caller (or closing the iterator) kills every sandbox.
+    """
+    rejected, runnable = _split_malformed_cases(test_cases_list)
+    for detail in rejected:
+        yield detail
+    if not runnable:
+        return
+    deadline = time.monotonic() + submission_timeout
+    shards = [
+        (indexes, partial(_run_shard_async, code, test_cases_list, indexes, timeout, deadline))
+        for indexes in _shard_indexes(runnable, parallelism)
+    ]
+    results = afan_out(shards, deadline)
+    try:
+        async for i, result in results:
+            yield test_case_detail(i, test_cases_list[i], result)
+    finally:
+        await results.aclose()
+
+
+def normalize_code(code: str) -> str:
+    """
+    Line endings (the compiler reads any as "\n") and whitespace after the
+    last line never change what code does. Trailing whitespace on other lines
+    is kept: it may be inside a multi-line string.
     """
+    return code.replace("\r\n", "\n").replace("\r", "\n").rstrip()
+
+
+def execution_cache_key(code: str, test_cases_list: List[Dict], timeout: float) -> str:
+    return make_key(
+        EXECUTOR_VERSION, normalize_code(code), test_cases_list, sys.version, timeout, sandbox_limits(),
+    )
+
+
+def _cacheable(results: Dict) -> bool:
+    """
+    Only verdicts the code itself decided: timeouts depend on load, and
+    sandbox failures (a crashed worker) carry no usage
+    """
+    return all(detail["status"] != "timeout" and detail.get("usage") for detail in results["details"])
+
+
+def _cached_execution(key: str) -> Optional[Dict]:
+    cached = execution_cache.get(key)
+    if cached is not None:
+        cached["cached"] = True
+    return cached
+
+
+def _store_execution(key: str, results: Dict) -> Dict:
+    if _cacheable(results):
+        execution_cache.set(key, results)
+    results["cached"] = False
+    return results
+
+
+def _rejected(results: Dict, error: str) -> Dict:
+    """Code that never ran: one diagnostic instead of the same error for every case"""
+    results["failed"] = results["total"]
+    results["error"] = error
+    results["usage"] = total_usage([])
+    results["cached"] = False
+    return results
+
+
+def parse_test_cases(test_cases: str) -> List[Dict]:
+    """The JSON list of test cases, [] if it isn't one"""
     try:
-        test_cases_list = json.loads(test_cases) if test_cases else []
+        parsed = json.loads(test_cases) if test_cases else []
     except:
-        test_cases_list = []
+        return []
+    return parsed if isinstance(parsed, list) else []
+
+
+def execute_code_safely(
+    code: str,
+    test_cases: str,
+    timeout: int = 5,
+    submission_timeout: float = SANDBOX_SUBMISSION_TIMEOUT,
+) -> Dict:
+    """
+    Execute code in a restricted environment
+    Returns execution results; "cached" tells whether they were reused
+    from an earlier run of the same code and test cases
+    """
+    test_cases_list = parse_test_cases(test_cases)
     
     results = {
         "passed": 0,
@@ -23,109 +327,105 @@ def execute_code_safely(code: str, test_cases: str, timeout: int = 5) -> Dict:
     
     if not test_cases_list:
         return results
-    
-    for i, test_case in enumerate(test_cases_list):
-        try:
-            # Create a test script
-            test_script = f"""
-import sys
-import json
-from io import StringIO
 
-# Capture stdout
-old_stdout = sys.stdout
-sys.stdout = StringIO()
+    cache_key = execution_cache_key(code, test_cases_list, timeout)
+    cached = _cached_execution(cache_key)
+    if cached is not None:
+        return cached
 
-try:
-    # User's code
-{chr(10).join('    ' + line for line in code.split(chr(10)))}
-    
-    # Get the output
-    output = sys.stdout.getvalue()
-    sys.stdout = old_stdout
-    
-    # Execute test
-    input_data = {json.dumps(test_case.get('input', {}))}
-    expected = {json.dumps(test_case.get('expected', ''))}
-    
-    # Try to call main function if exists
-    result = None
-    if 'main' in dir():
-        result = main(**input_data) if isinstance(input_data, dict) else main(input_data)
+    syntax_error = compile_submission(code)
+    if syntax_error is not None:
+        return _rejected(results, syntax_error)
     
-    # Compare result
-    if result is not None:
-        print(json.dumps({{"result": str(result), "expected": str(expected), "match": str(result) == str(expected)}}))
-    else:
-        print(json.dumps({{"result": output.strip(), "expected": str(expected), "match": output.strip() == str(expected)}}))
-        
-except Exception as e:
-    sys.stdout = old_stdout
-    print(json.dumps({{"error": str(e)}}))
-"""
-            
-            # Execute with timeout
-            result = subprocess.run(
-                [sys.executable, "-c", test_script],
-                capture_output=True,
-                text=True,
-                timeout=timeout
-            )
-            
-            if result.returncode == 0:
-                try:
-                    test_result = json.loads(result.stdout)
-                    if test_result.get("match"):
-                        results["passed"] += 1
-                        results["details"].append({
-                            "test": i + 1,
-                            "status": "passed",
-                            "input": test_case.get("input"),
-                            "expected": test_case.get("expected"),
-                            "actual": test_result.get("result")
-                        })
-                    else:
-                        results["failed"] += 1
-                        results["details"].append({
-                            "test": i + 1,
-                            "status": "failed",
-                            "input": test_case.get("input"),
-                            "expected": test_result.get("expected"),
-                            "actual": test_result.get("result")
-                        })
-                except:
-                    results["failed"] += 1
-                    results["details"].append({
-                        "test": i + 1,
-                        "status": "error",
-                        "message": result.stdout or result.stderr
-                    })
-            else:
-                results["failed"] += 1
-                results["details"].append({
-                    "test": i + 1,
-                    "status": "error",
-                    "message": result.stderr
-                })
-                
-        except subprocess.TimeoutExpired:
-            results["failed"] += 1
-            results["details"].append({
-                "test": i + 1,
-                "status": "timeout",
-                "message": "Execution timed out"
-            })
-        except Exception as e:
-            results["failed"] += 1
-            results["details"].append({
-                "test": i + 1,
-                "status": "error",
-                "message": str(e)
-            })
+    for detail in iter_test_results(code, test_cases_list, timeout, submission_timeout):
+        _add_detail(results, detail)
+    # Cases finish out of order when they run in parallel
+    results["details"].sort(key=lambda detail: detail["test"])
+    results["usage"] = total_usage(results["details"])
     
+    return _store_execution(cache_key, results)
+
+
+async def execute_code_async(
+    code: str,
+    test_cases: str,
+    timeout: int = 5,
+    submission_timeout: float = SANDBOX_SUBMISSION_TIMEOUT,
+) -> Dict:
+    """
+    execute_code_safely for async callers, same result shape.
+    Cancelling the awaiting task kills the sandboxes still running.
+    """
+    async for event, data in stream_code_execution(code, test_cases, timeout, submission_timeout):
+        results = data  # the summary comes last
     return results
 
 
+async def stream_code_execution(
+    code: str,
+    test_cases: str,
+    timeout: int = 5,
+    submission_timeout: float = SANDBOX_SUBMISSION_TIMEOUT,
+) -> AsyncIterator[Tuple[str, Dict]]:
+    """
+    execute_code_async as it happens: yields ("case", details entry) as each
+    test case finishes, then ("summary", the execute_code_safely result).
+    Closing the iterator early kills the sandboxes still running.
+    """
+    test_cases_list = parse_test_cases(test_cases)
+    results = {"passed": 0, "failed": 0, "total": len(test_cases_list), "details": [], "error": None}
+    if not test_cases_list:
+        yield "summary", results
+        return
+
+    cache_key = execution_cache_key(code, test_cases_list, timeout)
+    cached = _cached_execution(cache_key)
+    if cached is not None:
+        for detail in cached["details"]:
+            yield "case", detail
+        yield "summary", cached
+        return
+
+    # Compiling a large submission takes a while; keep it off the event loop
+    syntax_error = await asyncio.get_running_loop().run_in_executor(None, compile_submission, code)
+    if syntax_error is not None:
+        yield "summary", _rejected(results, syntax_error)
+        return
+
+    details = aiter_test_results(code, test_cases_list, timeout, submission_timeout)
+    try:
+        async for detail in details:
+            _add_detail(results, detail)
+            yield "case", detail
+    finally:
+        await details.aclose()
+    results["details"].sort(key=lambda detail: detail["test"])
+    results["usage"] = total_usage(results["details"])
+    yield "summary", _store_execution(cache_key, results)
+
+
+def _add_detail(results: Dict, detail: Dict):
+    if detail["status"] == "passed":
+        results["passed"] += 1
+    else:
+        results["failed"] += 1
+    results["details"].append(detail)
+
+
+def total_usage(details: List[Dict]) -> Dict:
+    """What a whole submission cost: summed wall and CPU time, the largest peak RSS"""
+    usages = [detail["usage"] for detail in details if detail.get("usage")]
+
+    def known(key):
+        return [usage[key] for usage in usages if usage.get(key) is not None]
+
+    return {
+        "wall_ms": round(sum(known("wall_ms")), 2),
+        "cpu_ms": round(sum(known("cpu_ms")), 2) if known("cpu_ms") else None,
+        "peak_rss_kb": max(known("peak_rss_kb"), default=None),
+    }
+
+
 def evaluate_code_output(execution_results: Dict) -> float:
     """
     Calculate score based on test case results
@@ -0,0 +1,166 @@
+"""
+Ordered model fallback with a circuit breaker per model.
+
+A model that keeps failing is skipped (its breaker is open) instead of
+costing every request a failed call before the fallback. After a jittered
+recovery delay one request probes it (half-open); success closes the
+breaker, failure reopens it with the delay doubled up to a cap.
+"""
+import os
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Sequence, Tuple, TypeVar
+
+from google.genai import errors
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", "3"))  # consecutive failures to open
+BREAKER_RECOVERY_SECONDS = float(os.environ.get("BREAKER_RECOVERY_SECONDS", "30"))  # before the first probe
+BREAKER_MAX_RECOVERY_SECONDS = float(os.environ.get("BREAKER_MAX_RECOVERY_SECONDS", "300"))
+# Probes are spread over recovery * [1, 1 + jitter] so workers don't all probe at once
+BREAKER_JITTER = 0.2
+BREAKER_HISTORY = 20
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+T = TypeVar("T")
+
+
+class ModelsUnavailable(Exception):
+    """Every model in the chain is short-circuited by an open breaker"""
+
+
+def is_model_failure(e: BaseException) -> bool:
+    """
+    Whether an error says the model is unhealthy. Client errors are the
+    request's fault, except a missing model (404) or rate limiting (429).
+    """
+    if isinstance(e, errors.ClientError):
+        return e.code in (404, 429)
+    return True
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        recovery_seconds: float = BREAKER_RECOVERY_SECONDS,
+        max_recovery_seconds: float = BREAKER_MAX_RECOVERY_SECONDS,
+    ):
+        self.failure_threshold = max(1, failure_threshold)
+        self.recovery_seconds = recovery_seconds
+        self.max_recovery_seconds = max(recovery_seconds, max_recovery_seconds)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.failures = 0
+        self.short_circuited = 0
+        self.opened = 0
+        self._backoff = recovery_seconds
+        self._retry_at = 0.0
+        self._probing = False
+        self.transitions = deque(maxlen=BREAKER_HISTORY)
+
+    def _move(self, state: str, reason: str):
+        if state != self.state:
+            self.transitions.append({"at": time.time(), "from": self.state, "to": state, "reason": reason})
+            self.state = state
+
+    def _open(self, reason: str):
+        self.opened += 1
+        self._retry_at = time.monotonic() + self._backoff * random.uniform(1, 1 + BREAKER_JITTER)
+        self._move(OPEN, reason)
+
+    def allow(self) -> bool:
+        """Whether a call may go to this model now; lets one probe through once recovery is due"""
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() >= self._retry_at:
+            self._move(HALF_OPEN, "recovery probe")
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        self.short_circuited += 1
+        return False
+
+    def record_success(self):
+        self.successes += 1
+        self.consecutive_failures = 0
+        self._probing = False
+        self._backoff = self.recovery_seconds
+        self._move(CLOSED, "call succeeded")
+
+    def record_failure(self, reason: str = "call failed"):
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN:
+            self._probing = False
+            self._backoff = min(self._backoff * 2, self.max_recovery_seconds)
+            self._open(f"probe failed: {reason}")
+        elif self.state == CLOSED and self.consecutive_failures >= self.failure_threshold:
+            self._open(f"{self.consecutive_failures} consecutive failures: {reason}")
+
+    def release(self):
+        """The call ended without a verdict (cancelled, or the request's own fault)"""
+        if self._probing:
+            # Let the next request probe instead
+            self._probing = False
+            self._retry_at = 0.0
+            self._move(OPEN, "probe abandoned")
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "successes": self.successes,
+            "failures": self.failures,
+            "short_circuited": self.short_circuited,
+            "opened": self.opened,
+            "retry_in_s": round(max(0.0, self._retry_at - time.monotonic()), 2) if self.state != CLOSED else 0.0,
+            "transitions": list(self.transitions),
+        }
+
+
+class ModelChain:
+    """Tries models in order, skipping those whose breaker is open"""
+
+    def __init__(self, models: Sequence[str]):
+        self.models: List[str] = list(models)
+        self.breakers: Dict[str, CircuitBreaker] = {model: CircuitBreaker() for model in self.models}
+
+    async def call(self, fn: Callable[[str], Awaitable[T]]) -> Tuple[str, T]:
+        """
+        `await fn(model)` on the first healthy model that succeeds; returns
+        (model, result). Raises the last error if every tried model failed,
+        ModelsUnavailable if none could be tried.
+        """
+        last_error = None
+        for model in self.models:
+            breaker = self.breakers[model]
+            if not breaker.allow():
+                continue
+            try:
+                result = await fn(model)
+            except Exception as e:
+                print(f"{model} failed: {e}")
+                if is_model_failure(e):
+                    breaker.record_failure(type(e).__name__)
+                else:
+                    breaker.release()
+                last_error = e
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return model, result
+        if last_error is not None:
+            raise last_error
+        raise ModelsUnavailable(f"No healthy model among {', '.join(self.models)}")
+
+    def stats(self) -> dict:
+        return {model: breaker.stats() for model, breaker in self.breakers.items()}
+
+
+def models_from_env(name: str, default: str) -> List[str]:
+    return [model.strip() for model in os.environ.get(name, default).split(",") if model.strip()]
@@ -0,0 +1,139 @@
+import asyncio
+import codecs
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Mapping
+
+from .evaluation import RULE_WEIGHT, SIMILARITY_WEIGHT, evaluate_prompts_batch
+
+DEFAULT_CHUNK_SIZE = 256
+
+# Bulk jobs score on their own thread so they never compete with request handlers
+rescoring_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rescoring")
+
+
+def parse_record(line: str, line_number: int, challenges: Mapping[int, dict]) -> Dict:
+    """
+    Turn one NDJSON submission into an evaluate_prompts_batch item.
+
+    Records use the /submissions/create fields (challenge_id, user_prompt,
+    generated_output); expected_output and challenge_type default to the
+    challenge's, and an optional id is echoed back in the result.
+    """
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError("record must be a JSON object")
+    prompt = record.get("user_prompt", record.get("prompt"))
+    if not isinstance(prompt, str):
+        raise ValueError("user_prompt is required")
+
+    challenge = challenges.get(record.get("challenge_id"), {})
+    item = {
+        "line": line_number,
+        "id": record.get("id"),
+        "challenge_id": record.get("challenge_id"),
+        "prompt": prompt,
+        "generated_output": record.get("generated_output") or "",
+        "expected_output": record.get("expected_output", challenge.get("expected_output", "")),
+        "challenge_type": record.get("challenge_type", challenge.get("module_type", "general")),
+    }
+    for field in ("generated_output", "expected_output", "challenge_type"):
+        if not isinstance(item[field], str):
+            raise ValueError(f"{field} must be a string")
+    return item
+
+
+def score_chunk(
+    chunk: List[Dict],
+    rule_weight: float = RULE_WEIGHT,
+    similarity_weight: float = SIMILARITY_WEIGHT,
+) -> List[Dict]:
+    """Score parsed records (or pass through their parse errors), keeping input order"""
+    valid = [item for item in chunk if "error" not in item]
+    scored = iter(evaluate_prompts_batch(valid, rule_weight, similarity_weight))
+    results = []
+    for item in chunk:
+        if "error" in item:
+            results.append(item)
+            continue
+        result = next(scored)
+        results.append({"line": item["line"], "id": item["id"], "challenge_id": item["challenge_id"], **result})
+    return results
+
+
+class RecordParser:
+    """Incrementally splits NDJSON bytes into parsed records or per-line errors"""
+
+    def __init__(self, challenges: Mapping[int, dict]):
+        self.challenges = challenges
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._line_number = 0
+
+    def _parse_lines(self, lines: List[str]) -> Iterator[Dict]:
+        for line in lines:
+            self._line_number += 1
+            if not line.strip():
+                continue
+            try:
+                yield parse_record(line, self._line_number, self.challenges)
+            except (ValueError, TypeError) as e:
+                yield {"line": self._line_number, "error": str(e)}
+
+    def feed(self, data: bytes) -> Iterator[Dict]:
+        self._buffer += self._decoder.decode(data)
+        *lines, self._buffer = self._buffer.split("\n")
+        return self._parse_lines(lines)
+
+    def close(self) -> Iterator[Dict]:
+        self._buffer += self._decoder.decode(b"", final=True)
+        lines, self._buffer = [self._buffer], ""
+        return self._parse_lines(lines)
+
+
+def rescore_bytes(
+    body: Iterable[bytes],
+    challenges: Mapping[int, dict],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    rule_weight: float = RULE_WEIGHT,
+    similarity_weight: float = SIMILARITY_WEIGHT,
+) -> Iterator[Dict]:
+    """Rescore NDJSON input chunk by chunk; memory is bounded by chunk_size"""
+    parser = RecordParser(challenges)
+    chunk: List[Dict] = []
+    for data in body:
+        chunk.extend(parser.feed(data))
+        while len(chunk) >= chunk_size:
+            yield from score_chunk(chunk[:chunk_size], rule_weight, similarity_weight)
+            chunk = chunk[chunk_size:]
+    chunk.extend(parser.close())
+    if chunk:
+        yield from score_chunk(chunk, rule_weight, similarity_weight)
+
+
+async def rescore_stream(
+    body: AsyncIterator[bytes],
+    challenges: Mapping[int, dict],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    rule_weight: float = RULE_WEIGHT,
+    similarity_weight: float = SIMILARITY_WEIGHT,
+) -> AsyncIterator[str]:
+    """Async counterpart of rescore_bytes for a streamed request body, yields NDJSON text"""
+    loop = asyncio.get_running_loop()
+    parser = RecordParser(challenges)
+    chunk: List[Dict] = []
+
+    async def flush(items):
+        results = await loop.run_in_executor(
+            rescoring_executor, score_chunk, items, rule_weight, similarity_weight
+        )
+        return "".join(json.dumps(result) + "\n" for result in results)
+
+    async for data in body:
+        chunk.extend(parser.feed(data))
+        while len(chunk) >= chunk_size:
+            yield await flush(chunk[:chunk_size])
+            chunk = chunk[chunk_size:]
+    chunk.extend(parser.close())
+    if chunk:
+        yield await flush(chunk)
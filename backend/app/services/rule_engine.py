@@ -0,0 +1,86 @@
+import re
+from itertools import combinations
+from typing import Dict, FrozenSet, Iterable, Set
+
+try:
+    import ahocorasick
+except ImportError:  # Optional C extension, fall back to plain substring scans
+    ahocorasick = None
+
+
+class KeywordRuleSet:
+    """
+    Keyword categories compiled into Aho-Corasick automata when the rule set
+    is created.
+
+    `find` returns every category with at least one keyword occurring as a
+    substring of the text in a single pass over it. One automaton is built
+    per subset of categories, so once a category has been found the scan
+    continues with an automaton that only looks for the missing ones.
+    Without pyahocorasick installed each keyword is searched with `in`.
+    """
+
+    def __init__(self, categories: Dict[str, Iterable[str]]):
+        self.categories = tuple(categories)
+        self._keywords = {name: tuple(words) for name, words in categories.items()}
+        keywords: Dict[str, Set[str]] = {}
+        for name, words in categories.items():
+            for word in words:
+                keywords.setdefault(word, set()).add(name)
+        self._max_len = max((len(word) for word in keywords), default=0)
+
+        self._automata: Dict[FrozenSet[str], object] = {}
+        if ahocorasick is None:
+            return
+        for size in range(1, len(self.categories) + 1):
+            for subset in combinations(self.categories, size):
+                subset = frozenset(subset)
+                self._automata[subset] = self._build_automaton(keywords, subset)
+
+    @staticmethod
+    def _build_automaton(keywords: Dict[str, Set[str]], subset: FrozenSet[str]):
+        automaton = ahocorasick.Automaton()
+        for word, names in keywords.items():
+            if names & subset:
+                automaton.add_word(word, frozenset(names & subset))
+        automaton.make_automaton()
+        return automaton
+
+    def find(self, text: str) -> Set[str]:
+        """Return the categories matched in an already lowercased text"""
+        if ahocorasick is None:
+            return {
+                name for name, words in self._keywords.items()
+                if any(word in text for word in words)
+            }
+
+        found: Set[str] = set()
+        remaining = frozenset(self.categories)
+        pos = 0
+        while remaining:
+            automaton = self._automata[remaining]
+            if automaton.kind == ahocorasick.EMPTY:
+                break
+            hit = next(automaton.iter(text, pos), None)
+            if hit is None:
+                break
+            end, names = hit
+            found |= names
+            remaining = remaining - names
+            # Matches are reported by end offset, so rescan the longest
+            # keyword span to catch missing categories ending at `end`
+            pos = max(0, end - self._max_len + 1)
+        return found
+
+
+_WORD_RE = re.compile(r"\S+")
+
+
+def has_min_words(text: str, count: int) -> bool:
+    """Equivalent to len(text.split()) >= count without splitting the whole text"""
+    if count <= 0:
+        return True
+    for seen, _ in enumerate(_WORD_RE.finditer(text), 1):
+        if seen >= count:
+            return True
+    return False
@@ -0,0 +1,598 @@
+import asyncio
+import json
+import os
+import queue
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Workers are also the process-wide cap on sandboxes running at once, threaded and async alike
+SANDBOX_POOL_SIZE = int(os.environ.get("SANDBOX_POOL_SIZE", str(os.cpu_count() or 2)))  # 0 = one interpreter per test case
+SANDBOX_MAX_JOBS = int(os.environ.get("SANDBOX_MAX_JOBS", "100"))  # recycle a worker after this many jobs
+SANDBOX_CASE_PARALLELISM = int(os.environ.get("SANDBOX_CASE_PARALLELISM", "4"))  # sandboxes one submission may use
+SANDBOX_SUBMISSION_TIMEOUT = float(os.environ.get("SANDBOX_SUBMISSION_TIMEOUT", "30"))  # seconds for all cases
+# setrlimit caps on every process running user code, 0 = no limit
+SANDBOX_MEMORY_MB = int(os.environ.get("SANDBOX_MEMORY_MB", "512"))  # address space
+SANDBOX_CPU_SECONDS = int(os.environ.get("SANDBOX_CPU_SECONDS", "10"))  # per case, and for loading the module
+SANDBOX_MAX_OPEN_FILES = int(os.environ.get("SANDBOX_MAX_OPEN_FILES", "64"))
+# RLIMIT_NPROC counts every process and thread of the user running the app, so leave headroom
+SANDBOX_MAX_PROCESSES = int(os.environ.get("SANDBOX_MAX_PROCESSES", "512"))
+# Allowance on top of the per-case timeout for forking and reporting a case
+SUITE_TIMEOUT_MARGIN = 1.0
+# Longest an async caller sleeps between tries for a free sandbox
+ASYNC_POLL_INTERVAL = 0.02
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sandbox_worker.py")
+
+
+class SandboxCrashed(Exception):
+    """The worker process itself died (user code crashing only ends its forked child)"""
+
+
+class DeadlineExceeded(subprocess.TimeoutExpired):
+    """The submission's overall time budget ran out before this case finished"""
+
+
+SuiteOutcome = Union[subprocess.CompletedProcess, subprocess.TimeoutExpired, SandboxCrashed]
+
+
+def sandbox_limits() -> dict:
+    """The resource limits sent along with every sandbox job"""
+    return {
+        "address_space": SANDBOX_MEMORY_MB * 1024 * 1024,
+        "cpu_seconds": SANDBOX_CPU_SECONDS,
+        "open_files": SANDBOX_MAX_OPEN_FILES,
+        "processes": SANDBOX_MAX_PROCESSES,
+    }
+
+
+def _with_usage(outcome, usage: Optional[dict]):
+    """
+    Attach what the sandbox cost (wall_ms, cpu_ms, peak_rss_kb) to an outcome.
+    `python -c` fallbacks only know their wall time.
+    """
+    outcome.usage = usage
+    return outcome
+
+
+def _wall_usage(started: float) -> dict:
+    return {"wall_ms": round((time.monotonic() - started) * 1000, 2), "cpu_ms": None, "peak_rss_kb": None}
+
+
+def _expiry(timeout: float, deadline: Optional[float]):
+    """Monotonic time a wait expires, and the error to raise when it does"""
+    expires = time.monotonic() + timeout
+    if deadline is not None and deadline < expires:
+        return deadline, DeadlineExceeded
+    return expires, subprocess.TimeoutExpired
+
+
+def _load_failure_outcomes(args, done: dict, count: int) -> Iterator[Tuple[int, SuiteOutcome]]:
+    """The module ended the process while loading, so would every per-case script"""
+    for index in range(count):
+        yield index, subprocess.CompletedProcess(args, done["returncode"], done["stdout"], done["stderr"])
+
+
+def _case_outcome(args, result: dict, timeout: float) -> Tuple[int, SuiteOutcome]:
+    if "case" not in result:
+        raise SandboxCrashed(f"Sandbox suite exited with code {result.get('returncode')}")
+    if result.get("timeout"):
+        return result["case"], _with_usage(subprocess.TimeoutExpired(args, timeout), result.get("usage"))
+    return result["case"], _with_usage(
+        subprocess.CompletedProcess(args, result["returncode"], result["stdout"], result["stderr"]), result.get("usage")
+    )
+
+
+class SandboxWorker:
+    """One persistent `sandbox_worker.py` process, talked to over its stdin/stdout pipes"""
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, WORKER_SCRIPT],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,  # own process group, so killing it also kills a running job
+        )
+        self.jobs = 0
+        # Set when a job may have left processes behind in the worker's group
+        self.dirty = False
+        self._buffer = b""
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def _send(self, job: dict):
+        try:
+            self.process.stdin.write(json.dumps(job).encode("utf-8") + b"\n")
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise SandboxCrashed(f"Sandbox worker is gone: {e}")
+
+    def run(self, script: str, timeout: float, deadline: Optional[float] = None) -> subprocess.CompletedProcess:
+        """Same contract as subprocess.run([python, "-c", script], capture_output=True, text=True, timeout=timeout)"""
+        self.jobs += 1
+        args = [sys.executable, "-c", script]
+        self._send({"script": script, "limits": sandbox_limits()})
+        result = json.loads(self._read_line(args, timeout, deadline))
+        return _with_usage(
+            subprocess.CompletedProcess(args, result["returncode"], result["stdout"], result["stderr"]), result.get("usage")
+        )
+
+    def run_suite(
+        self, code: str, cases: List[dict], timeout: float, deadline: Optional[float] = None
+    ) -> Iterator[Tuple[int, SuiteOutcome]]:
+        """
+        Load `code` once and run every case against it, yielding (index, outcome)
+        as each case finishes. Outcomes are CompletedProcess or TimeoutExpired.
+        """
+        self.jobs += 1
+        args = [sys.executable, "-c", code]
+        self._send({"code": code, "cases": cases, "timeout": timeout, "limits": sandbox_limits()})
+        # Loading the module gets one timeout of its own, as every per-case script used to
+        loaded = json.loads(self._read_line(args, timeout + SUITE_TIMEOUT_MARGIN, deadline))
+        if loaded.get("done"):
+            yield from _load_failure_outcomes(args, loaded, len(cases))
+            return
+        for _ in cases:
+            index, outcome = _case_outcome(
+                args, json.loads(self._read_line(args, timeout + SUITE_TIMEOUT_MARGIN, deadline)), timeout
+            )
+            if isinstance(outcome, subprocess.TimeoutExpired):
+                self.dirty = True
+            yield index, outcome
+        self._read_line(args, timeout + SUITE_TIMEOUT_MARGIN, deadline)
+
+    async def arun(self, script: str, timeout: float, deadline: Optional[float] = None) -> subprocess.CompletedProcess:
+        """run() without blocking the event loop"""
+        self.jobs += 1
+        args = [sys.executable, "-c", script]
+        self._send({"script": script, "limits": sandbox_limits()})
+        result = json.loads(await self._aread_line(args, timeout, deadline))
+        return _with_usage(
+            subprocess.CompletedProcess(args, result["returncode"], result["stdout"], result["stderr"]), result.get("usage")
+        )
+
+    async def arun_suite(
+        self, code: str, cases: List[dict], timeout: float, deadline: Optional[float] = None
+    ) -> AsyncIterator[Tuple[int, SuiteOutcome]]:
+        """run_suite() without blocking the event loop"""
+        self.jobs += 1
+        args = [sys.executable, "-c", code]
+        self._send({"code": code, "cases": cases, "timeout": timeout, "limits": sandbox_limits()})
+        loaded = json.loads(await self._aread_line(args, timeout + SUITE_TIMEOUT_MARGIN, deadline))
+        if loaded.get("done"):
+            for outcome in _load_failure_outcomes(args, loaded, len(cases)):
+                yield outcome
+            return
+        for _ in cases:
+            index, outcome = _case_outcome(
+                args, json.loads(await self._aread_line(args, timeout + SUITE_TIMEOUT_MARGIN, deadline)), timeout
+            )
+            if isinstance(outcome, subprocess.TimeoutExpired):
+                self.dirty = True
+            yield index, outcome
+        await self._aread_line(args, timeout + SUITE_TIMEOUT_MARGIN, deadline)
+
+    def _read_line(self, args, timeout: float, deadline: Optional[float] = None) -> bytes:
+        """Next result line; times out after `timeout` seconds or at the monotonic `deadline`"""
+        expires, timeout_error = _expiry(timeout, deadline)
+        fd = self.process.stdout.fileno()
+        while b"\n" not in self._buffer:
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                raise timeout_error(args, timeout)
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if not ready:
+                continue
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise SandboxCrashed(f"Sandbox worker exited with code {self.process.wait()}")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return line
+
+    async def _aread_line(self, args, timeout: float, deadline: Optional[float] = None) -> bytes:
+        """_read_line, waiting for the pipe on the event loop instead of in select()"""
+        expires, timeout_error = _expiry(timeout, deadline)
+        fd = self.process.stdout.fileno()
+        loop = asyncio.get_running_loop()
+        while b"\n" not in self._buffer:
+            readable = loop.create_future()
+            loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+            try:
+                await asyncio.wait_for(readable, max(0.0, expires - time.monotonic()))
+            except asyncio.TimeoutError:
+                raise timeout_error(args, timeout)
+            finally:
+                loop.remove_reader(fd)
+            chunk = os.read(fd, 65536)
+            if not chunk:
+                raise SandboxCrashed(f"Sandbox worker exited with code {self.process.wait()}")
+            self._buffer += chunk
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return line
+
+    def kill(self):
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.process.wait()
+        self.process.stdin.close()
+        self.process.stdout.close()
+
+
+class SandboxPool:
+    """
+    Pre-forked pool of persistent sandbox interpreters.
+
+    Each job runs in a fresh child forked from an idle worker, skipping the
+    20-40 ms interpreter startup of `python -c` per test case. Workers are
+    replaced after `max_jobs` jobs, after a timeout (the whole process
+    group is killed) and whenever they die; replacements are started
+    immediately so the next job finds a warm interpreter.
+    """
+
+    def __init__(self, size: int = SANDBOX_POOL_SIZE, max_jobs: int = SANDBOX_MAX_JOBS):
+        self.size = max(0, size)
+        self.max_jobs = max(1, max_jobs)
+        self._slots: "queue.Queue[Optional[SandboxWorker]]" = queue.Queue()
+        for _ in range(self.size):
+            self._slots.put(None)
+        self._lock = threading.Lock()
+        # Caps the one-off sandboxes run when the pool is disabled
+        self._fallback_capacity = os.cpu_count() or 2
+        self._fallback_slots = threading.BoundedSemaphore(self._fallback_capacity)
+        self.started = 0
+        self.jobs = 0
+        self.recycled = 0
+        self.timeouts = 0
+        self.crashes = 0
+
+    @property
+    def enabled(self) -> bool:
+        # Workers fork per job, which needs a POSIX host
+        return self.size > 0 and hasattr(os, "fork")
+
+    @property
+    def capacity(self) -> int:
+        """How many sandboxes may run at once across the whole process"""
+        return self.size if self.enabled else self._fallback_capacity
+
+    def _spawn(self) -> SandboxWorker:
+        with self._lock:
+            self.started += 1
+        return SandboxWorker()
+
+    def start(self):
+        """Fork every worker up front instead of on first use"""
+        if not self.enabled:
+            return
+        workers = [self._slots.get() for _ in range(self.size)]
+        for worker in workers:
+            self._slots.put(worker if worker is not None and worker.alive() else self._spawn())
+
+    @contextmanager
+    def _checkout(self, args, deadline: Optional[float] = None) -> Iterator[SandboxWorker]:
+        """Borrow an idle worker; it is replaced unless the job left it healthy"""
+        try:
+            worker = self._slots.get(timeout=None if deadline is None else max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            raise DeadlineExceeded(args, 0)
+        healthy = False
+        try:
+            if worker is None or not worker.alive():
+                worker = self._spawn()
+            yield worker
+            healthy = True
+        except (subprocess.TimeoutExpired, SandboxCrashed) as e:
+            self._count_failure(e)
+            raise
+        finally:
+            self._checkin(worker, healthy)
+
+    @asynccontextmanager
+    async def _acheckout(self, args, deadline: Optional[float] = None) -> AsyncIterator[SandboxWorker]:
+        """_checkout for async callers; cancelling them kills the worker's process group"""
+        taken = []
+
+        def take() -> bool:
+            try:
+                taken.append(self._slots.get_nowait())
+            except queue.Empty:
+                return False
+            return True
+
+        await _poll(take, args, deadline)
+        worker = taken[0]
+        healthy = False
+        try:
+            if worker is None or not worker.alive():
+                worker = self._spawn()
+            yield worker
+            healthy = True
+        except (subprocess.TimeoutExpired, SandboxCrashed) as e:
+            self._count_failure(e)
+            raise
+        finally:
+            self._checkin(worker, healthy)
+
+    def _count_failure(self, e: Exception):
+        with self._lock:
+            if isinstance(e, SandboxCrashed):
+                self.crashes += 1
+            else:
+                self.timeouts += 1
+
+    def _checkin(self, worker: Optional[SandboxWorker], healthy: bool):
+        with self._lock:
+            self.jobs += 1
+        if worker is not None and not (healthy and worker.alive() and not worker.dirty and worker.jobs < self.max_jobs):
+            worker.kill()
+            with self._lock:
+                self.recycled += 1
+            try:
+                worker = self._spawn()
+            except OSError:
+                worker = None  # retried on the next job
+        self._slots.put(worker)
+
+    def run(self, script: str, timeout: float, deadline: Optional[float] = None) -> subprocess.CompletedProcess:
+        args = [sys.executable, "-c", script]
+        if self.enabled:
+            with self._checkout(args, deadline) as worker:
+                return worker.run(script, timeout, deadline)
+
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if not self._fallback_slots.acquire(timeout=None if remaining is None else max(0.0, remaining)):
+            raise DeadlineExceeded(args, 0)
+        try:
+            started = time.monotonic()
+            if hasattr(os, "fork"):
+                worker = SandboxWorker()
+                try:
+                    return worker.run(script, timeout, deadline)
+                except subprocess.TimeoutExpired as e:
+                    raise _with_usage(e, _wall_usage(started))
+                finally:
+                    worker.kill()
+
+            # No fork, so no setrlimit either: a plain unlimited `python -c`
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining < timeout:
+                try:
+                    completed = subprocess.run(args, capture_output=True, text=True, timeout=max(0.0, remaining))
+                except subprocess.TimeoutExpired:
+                    raise _with_usage(DeadlineExceeded(args, timeout), _wall_usage(started))
+            else:
+                try:
+                    completed = subprocess.run(args, capture_output=True, text=True, timeout=timeout)
+                except subprocess.TimeoutExpired as e:
+                    raise _with_usage(e, _wall_usage(started))
+            return _with_usage(completed, _wall_usage(started))
+        finally:
+            self._fallback_slots.release()
+
+    def run_suite(
+        self, code: str, cases: List[dict], timeout: float, deadline: Optional[float] = None
+    ) -> Iterator[Tuple[int, SuiteOutcome]]:
+        """
+        Run every case against one load of `code` in a single worker, yielding
+        (index, outcome) as cases finish. If the load times out or the worker
+        dies, the cases not yet reported get that exception as their outcome.
+        """
+        reported = 0
+        try:
+            with self._checkout([sys.executable, "-c", code], deadline) as worker:
+                for outcome in worker.run_suite(code, cases, timeout, deadline):
+                    reported += 1
+                    yield outcome
+        except (subprocess.TimeoutExpired, SandboxCrashed) as e:
+            for index in range(reported, len(cases)):
+                yield index, e
+
+    async def arun(self, script: str, timeout: float, deadline: Optional[float] = None) -> subprocess.CompletedProcess:
+        """
+        run() for async callers. It waits for the same slots as run(), so the
+        two paths together never exceed `capacity` sandboxes.
+        """
+        args = [sys.executable, "-c", script]
+        if self.enabled:
+            async with self._acheckout(args, deadline) as worker:
+                return await worker.arun(script, timeout, deadline)
+
+        await _poll(lambda: self._fallback_slots.acquire(blocking=False), args, deadline)
+        try:
+            started = time.monotonic()
+            if hasattr(os, "fork"):
+                worker = SandboxWorker()
+                try:
+                    return await worker.arun(script, timeout, deadline)
+                except subprocess.TimeoutExpired as e:
+                    raise _with_usage(e, _wall_usage(started))
+                finally:
+                    worker.kill()
+
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            try:
+                expires, timeout_error = _expiry(timeout, deadline)
+                try:
+                    stdout, stderr = await asyncio.wait_for(
+                        process.communicate(), max(0.0, expires - time.monotonic())
+                    )
+                except asyncio.TimeoutError:
+                    raise _with_usage(timeout_error(args, timeout), _wall_usage(started))
+            finally:
+                await _kill_group(process)
+        finally:
+            self._fallback_slots.release()
+        return _with_usage(
+            subprocess.CompletedProcess(
+                args, process.returncode, stdout.decode("utf-8", "replace"), stderr.decode("utf-8", "replace")
+            ),
+            _wall_usage(started),
+        )
+
+    async def arun_suite(
+        self, code: str, cases: List[dict], timeout: float, deadline: Optional[float] = None
+    ) -> AsyncIterator[Tuple[int, SuiteOutcome]]:
+        """run_suite for async callers; closing or cancelling it kills the worker"""
+        reported = 0
+        try:
+            async with self._acheckout([sys.executable, "-c", code], deadline) as worker:
+                async for outcome in worker.arun_suite(code, cases, timeout, deadline):
+                    reported += 1
+                    yield outcome
+        except (subprocess.TimeoutExpired, SandboxCrashed) as e:
+            for index in range(reported, len(cases)):
+                yield index, e
+
+    def shutdown(self):
+        for _ in range(self.size):
+            worker = self._slots.get()
+            if worker is not None:
+                worker.kill()
+        for _ in range(self.size):
+            self._slots.put(None)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "size": self.size,
+            "capacity": self.capacity,
+            "idle": self._slots.qsize(),
+            "max_jobs": self.max_jobs,
+            "started": self.started,
+            "jobs": self.jobs,
+            "recycled": self.recycled,
+            "timeouts": self.timeouts,
+            "crashes": self.crashes,
+        }
+
+
+async def _poll(acquire: Callable[[], bool], args, deadline: Optional[float]):
+    """
+    Wait for a slot the threaded path blocks on, without blocking the loop:
+    retry the non-blocking `acquire()` with a growing sleep in between.
+    """
+    delay = 0.001
+    while not acquire():
+        if deadline is not None and time.monotonic() >= deadline:
+            raise DeadlineExceeded(args, 0)
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, ASYNC_POLL_INTERVAL)
+
+
+sandbox_pool = SandboxPool()
+
+# Threads only wait on sandbox pipes; the pool's slots bound the actual sandboxes
+_fan_out_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="sandbox")
+
+Shard = Tuple[Sequence[int], Callable[[], Iterator[Tuple[int, SuiteOutcome]]]]
+
+
+def fan_out(shards: List[Shard], deadline: float) -> Iterator[Tuple[int, SuiteOutcome]]:
+    """
+    Run shards of test cases concurrently, yielding (index, outcome) in
+    completion order. Each shard is (case indexes, callable yielding their
+    outcomes); cases still unreported at the monotonic `deadline` get
+    DeadlineExceeded while their shards give up on their own.
+    """
+    results: "queue.Queue[Tuple[int, SuiteOutcome]]" = queue.Queue()
+
+    def drain(indexes: Sequence[int], run: Callable):
+        try:
+            for item in run():
+                results.put(item)
+        except Exception as e:
+            for index in indexes:
+                results.put((index, e))
+
+    pending = set()
+    for indexes, run in shards:
+        pending.update(indexes)
+        _fan_out_executor.submit(drain, indexes, run)
+
+    while pending:
+        try:
+            index, outcome = results.get(timeout=max(0.0, deadline - time.monotonic()))
+        except queue.Empty:
+            break
+        if index in pending:
+            pending.discard(index)
+            yield index, outcome
+    for index in sorted(pending):
+        yield index, DeadlineExceeded([sys.executable], 0)
+
+
+# Asyncio path: worker pipes are read on the event loop, and on hosts without
+# fork `python -c` sandboxes are its child processes, so awaiting a run never
+# blocks the loop or ties up a thread
+async def _kill_group(process: asyncio.subprocess.Process):
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+    # Drain the pipes and reap it while the loop is alive, or its transport
+    # is finalized on a closed loop. The child is already dead, so finish
+    # that even when cancelled mid-way, then let the cancellation through.
+    reap = asyncio.ensure_future(process.communicate())
+    try:
+        await asyncio.shield(reap)
+    except asyncio.CancelledError:
+        await reap
+        raise
+
+
+AsyncShard = Tuple[Sequence[int], Callable[[], AsyncIterator[Tuple[int, SuiteOutcome]]]]
+
+
+async def afan_out(shards: List[AsyncShard], deadline: float) -> AsyncIterator[Tuple[int, SuiteOutcome]]:
+    """fan_out for async shards; closing the iterator early cancels every shard"""
+    results: "asyncio.Queue[Tuple[int, SuiteOutcome]]" = asyncio.Queue()
+
+    async def drain(indexes: Sequence[int], run: Callable):
+        try:
+            async for item in run():
+                await results.put(item)
+        except Exception as e:
+            for index in indexes:
+                await results.put((index, e))
+
+    pending = set()
+    tasks = []
+    for indexes, run in shards:
+        pending.update(indexes)
+        tasks.append(asyncio.ensure_future(drain(indexes, run)))
+
+    try:
+        while pending:
+            try:
+                index, outcome = await asyncio.wait_for(results.get(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                break
+            if index in pending:
+                pending.discard(index)
+                yield index, outcome
+        for index in sorted(pending):
+            yield index, DeadlineExceeded([sys.executable], 0)
+    finally:
+        if pending:
+            for task in tasks:
+                task.cancel()
+        # Every case reported: shards only have their workers' last lines to
+        # read, and are left to, so the workers go back to the pool. Otherwise
+        # let every shard kill its sandbox before the caller moves on.
+        await asyncio.gather(*tasks, return_exceptions=True)
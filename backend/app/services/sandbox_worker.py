@@ -0,0 +1,322 @@
+"""
+Persistent sandbox worker, started by SandboxPool as `python sandbox_worker.py`.
+
+Reads one JSON job per line on stdin and answers with JSON lines on
+stdout. Jobs run in children forked from this already-initialized
+interpreter, so user code never pays interpreter startup and never sees
+state left behind by earlier jobs. Deliberately imports nothing from the
+app so workers start fast.
+
+Script job, one result line:
+    {"script": "<python source>", "limits": {...}}
+    {"returncode": int, "stdout": str, "stderr": str, "usage": {...}}
+
+Suite job, one line per event as it happens:
+    {"code": "<user code>", "cases": [{"input": ..., "expected": ...}], "timeout": seconds, "limits": {...}}
+    {"loaded": true}
+    {"case": i, "returncode": int, "stdout": str, "stderr": str, "usage": {...}}
+        or {"case": i, "timeout": true, "usage": {...}}
+    {"done": true, "returncode": int, "stdout": str, "stderr": str}
+
+"limits" are setrlimit caps applied to the process running user code (see
+SandboxPool.limits); "usage" is what that process cost: wall_ms, cpu_ms
+and peak_rss_kb.
+"""
+import io
+import json
+import os
+import select
+import signal
+import sys
+import tempfile
+import time
+import traceback
+
+try:
+    import resource
+except ImportError:  # the app also imports this module for its templates, on any host
+    resource = None
+
+# Job "limits" keys and the setrlimit resources they cap
+LIMITS = {
+    "address_space": "RLIMIT_AS",
+    "cpu_seconds": "RLIMIT_CPU",
+    "open_files": "RLIMIT_NOFILE",
+    "processes": "RLIMIT_NPROC",
+}
+
+# Standalone test script loading the user's module, as _load_module does;
+# CASE_SOURCE follows it. {code} is the repr of already validated source,
+# run as written instead of re-indented into the script.
+SCRIPT_SOURCE = """import sys
+import json
+from io import StringIO
+
+old_stdout = sys.stdout
+sys.stdout = StringIO()
+__load_error__ = None
+try:
+    exec(compile({code}, "<string>", "exec"))
+except Exception as e:
+    __load_error__ = e
+"""
+
+# The per-case half of execute_code_safely's test script, run after the user's module
+CASE_SOURCE = """
+try:
+    if __load_error__ is not None:
+        raise __load_error__
+
+    # Get the output
+    output = sys.stdout.getvalue()
+    sys.stdout = old_stdout
+
+    # Execute test
+    input_data = {input}
+    expected = {expected}
+
+    # Try to call main function if exists
+    result = None
+    if 'main' in dir():
+        result = main(**input_data) if isinstance(input_data, dict) else main(input_data)
+
+    # Compare result
+    if result is not None:
+        print(json.dumps({{"result": str(result), "expected": str(expected), "match": str(result) == str(expected)}}))
+    else:
+        print(json.dumps({{"result": output.strip(), "expected": str(expected), "match": output.strip() == str(expected)}}))
+
+except Exception as e:
+    sys.stdout = old_stdout
+    print(json.dumps({{"error": str(e)}}))
+"""
+
+
+def _exit_status(e: BaseException, tb) -> int:
+    """What the interpreter prints and exits with when `e` escapes a script"""
+    if isinstance(e, SystemExit):
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        print(e.code, file=sys.stderr)
+        return 1
+    traceback.print_exception(type(e), e, tb)
+    return 1
+
+
+def _exec(code, namespace: dict) -> int:
+    """Run `code` like `python -c` would; returns the exit code"""
+    try:
+        if isinstance(code, str):
+            code = compile(code, "<string>", "exec")
+        exec(code, namespace)
+    except BaseException as e:
+        # Drop this frame so the traceback reads like the interpreter's own
+        # (and a SyntaxError from compiling the script prints without one)
+        return _exit_status(e, e.__traceback__.tb_next)
+    return 0
+
+
+def _apply_limits(limits: dict):
+    """Cap this process (and whatever it forks); 0 or a missing key leaves a limit alone"""
+    for name, value in (limits or {}).items():
+        if value and name in LIMITS:
+            # A second of slack on the hard CPU limit so SIGXCPU, not SIGKILL, reports it
+            resource.setrlimit(getattr(resource, LIMITS[name]), (value, value + 1 if name == "cpu_seconds" else value))
+
+
+def _exit_code(status: int) -> int:
+    """subprocess-style return code of a wait status: negative for the killing signal"""
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def _wait(pid: int, started: float):
+    """Reap `pid`; returns its exit code and what it cost"""
+    _, status, rusage = os.wait4(pid, 0)
+    peak_rss = rusage.ru_maxrss // 1024 if sys.platform == "darwin" else rusage.ru_maxrss  # bytes on macOS
+    return _exit_code(status), {
+        "wall_ms": round((time.monotonic() - started) * 1000, 2),
+        "cpu_ms": round((rusage.ru_utime + rusage.ru_stime) * 1000, 2),
+        "peak_rss_kb": peak_rss,
+    }
+
+
+def _redirect(stdout_fd: int, stderr_fd: int):
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(stdout_fd, 1)
+    os.dup2(stderr_fd, 2)
+    sys.stdin = open(0, "r", closefd=False)
+    sys.stdout = open(1, "w", encoding="utf-8", closefd=False)
+    sys.stderr = open(2, "w", encoding="utf-8", closefd=False)
+
+
+def _read(f) -> str:
+    f.seek(0)
+    return f.read().decode("utf-8", "replace")
+
+
+def _wait_for_eof(fd: int, timeout: float) -> bool:
+    """Block until every writer of the pipe has exited, False on timeout"""
+    deadline = time.monotonic() + timeout
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        ready, _, _ = select.select([fd], [], [], remaining)
+        if ready and not os.read(fd, 4096):
+            return True
+
+
+def run_job(job: dict) -> dict:
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        started = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                _redirect(out.fileno(), err.fileno())
+                _apply_limits(job.get("limits"))
+                sys.argv = ["-c"]
+                code = _exec(job["script"], {"__name__": "__main__", "__builtins__": __builtins__})
+            finally:
+                try:
+                    sys.stdout.flush()
+                    sys.stderr.flush()
+                finally:
+                    os._exit(code)
+
+        returncode, usage = _wait(pid, started)
+        return {"returncode": returncode, "stdout": _read(out), "stderr": _read(err), "usage": usage}
+
+
+def _load_module(code: str) -> dict:
+    """
+    Run the user's module once, as the top of execute_code_safely's test
+    script would: stdout captured, any exception kept for every case to report.
+    """
+    namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+    exec("import sys\nimport json\nfrom io import StringIO\nold_stdout = sys.stdout\n", namespace)
+    sys.stdout = io.StringIO()
+    namespace["__load_error__"] = namespace["__fatal_error__"] = None
+    try:
+        compiled = compile(code, "<string>", "exec")
+    except SyntaxError as e:
+        # The whole test script would fail to compile, before its try block could run
+        namespace["__fatal_error__"] = (e, None)
+        return namespace
+    try:
+        exec(compiled, namespace)
+    except Exception as e:
+        namespace["__load_error__"] = e
+    except BaseException as e:
+        # SystemExit and friends escape the script's `except Exception`
+        namespace["__fatal_error__"] = (e, e.__traceback__.tb_next)
+    return namespace
+
+
+def _run_case(namespace: dict, case: dict, timeout: float, prefix_out: str, prefix_err: str, results_fd: int) -> dict:
+    """Run one case in a fork of the loaded module, so cases can't see each other's state"""
+    source = CASE_SOURCE.format(
+        input=json.dumps(case.get("input", {})), expected=json.dumps(case.get("expected", ""))
+    )
+    sys.stdout.flush()
+    sys.stderr.flush()
+    namespace["old_stdout"].flush()
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        done_r, done_w = os.pipe()
+        started = time.monotonic()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                os.close(done_r)
+                os.close(results_fd)
+                captured = sys.stdout
+                _redirect(out.fileno(), err.fileno())
+                namespace["old_stdout"], sys.stdout = sys.stdout, captured
+                if namespace["__fatal_error__"] is not None:
+                    code = _exit_status(*namespace["__fatal_error__"])
+                else:
+                    code = _exec(source, namespace)
+            finally:
+                try:
+                    namespace["old_stdout"].flush()
+                    sys.stderr.flush()
+                finally:
+                    os._exit(code)
+
+        os.close(done_w)
+        finished = _wait_for_eof(done_r, timeout)
+        os.close(done_r)
+        if not finished:
+            # Anything the case started itself stays in the worker's process
+            # group, which the pool kills after a suite with a timed out case
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        returncode, usage = _wait(pid, started)
+        if not finished:
+            return {"timeout": True, "usage": usage}
+        return {
+            "returncode": returncode,
+            "stdout": prefix_out + _read(out),
+            "stderr": prefix_err + _read(err),
+            "usage": usage,
+        }
+
+
+def run_suite(job: dict, results) -> dict:
+    """Load the user code once in a child, then run each case in a fork of it, streaming results"""
+    results.flush()
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                results = os.fdopen(os.dup(results.fileno()), "wb")
+                _redirect(out.fileno(), err.fileno())
+                # Forked cases inherit the limits, with their CPU time counted from zero
+                _apply_limits(job.get("limits"))
+                sys.argv = ["-c"]
+                namespace = _load_module(job["code"])
+                results.write(b'{"loaded": true}\n')
+                results.flush()
+
+                # Anything written straight to the file descriptors while loading shows up in every case
+                sys.stderr.flush()
+                namespace["old_stdout"].flush()
+                prefix_out, prefix_err = _read(out), _read(err)
+                for i, case in enumerate(job["cases"]):
+                    result = _run_case(
+                        namespace, case, job["timeout"], prefix_out, prefix_err, results.fileno()
+                    )
+                    results.write(json.dumps({"case": i, **result}).encode("utf-8") + b"\n")
+                    results.flush()
+                code = 0
+            finally:
+                os._exit(code)
+
+        _, status = os.waitpid(pid, 0)
+        # Output of a load that killed the process outright, which then stands in for every case
+        return {"done": True, "returncode": _exit_code(status), "stdout": _read(out), "stderr": _read(err)}
+
+
+def main():
+    jobs = sys.stdin.buffer
+    results = sys.stdout.buffer
+    for line in jobs:
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        result = run_suite(job, results) if "cases" in job else run_job(job)
+        results.write(json.dumps(result).encode("utf-8") + b"\n")
+        results.flush()
+
+
+if __name__ == "__main__":
+    main()
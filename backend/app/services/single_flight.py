@@ -0,0 +1,62 @@
+"""
+Single-flight coalescing of identical concurrent calls.
+
+While a call for a key is in flight, further calls with the same key wait
+for it and share its result or its error instead of starting their own.
+Nothing is remembered once it finishes; that's what the caches are for.
+"""
+import asyncio
+from typing import Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.calls = 0
+        self.executed = 0
+        self.collapsed = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """`await fn()`, unless a call for `key` is already running, in which case its outcome"""
+        self.calls += 1
+        task = self._flights.get(key)
+        if task is None:
+            self.executed += 1
+            # Its own task, so one caller going away doesn't cancel it for the others
+            task = asyncio.ensure_future(fn())
+            self._flights[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda _: self._finish(key, task))
+        else:
+            self.collapsed += 1
+
+        self._waiters[key] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and self._waiters.get(key) == 1 and self._flights.get(key) is task:
+                # Nobody else is waiting for it
+                task.cancel()
+            raise
+        finally:
+            if self._flights.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._flights.get(key) is task:
+            del self._flights[key]
+            del self._waiters[key]
+        if not task.cancelled():
+            task.exception()  # retrieved by the waiters; don't warn if there were none left
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "executed": self.executed,
+            "collapsed": self.collapsed,
+            "in_flight": len(self._flights),
+            "collapse_ratio": round(self.collapsed / self.calls, 4) if self.calls else 0.0,
+        }
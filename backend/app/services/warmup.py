@@ -0,0 +1,115 @@
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from . import evaluation
+from .inference_backends import SIMILARITY_BACKEND
+
+_lock = threading.Lock()
+_thread: Optional[threading.Thread] = None
+_status = {
+    "state": "pending",  # pending -> warming -> ready, or straight to ready when skipped
+    "model": "pending",
+    "backend": None,
+    "tokenizer": "pending",
+    "embedding_index": "pending",
+    "embedding_index_entries": 0,
+    "embedding_index_encoded": 0,
+    "error": None,
+}
+_timings: Dict[str, float] = {}
+
+
+def _timed(step: str, fn):
+    started = time.perf_counter()
+    try:
+        return fn()
+    finally:
+        _timings[step] = round((time.perf_counter() - started) * 1000, 1)
+
+
+def _import_backend():
+    if SIMILARITY_BACKEND == "onnx":
+        import onnxruntime  # noqa: F401
+    else:
+        import sentence_transformers  # noqa: F401
+
+
+def _warm_up(expected_outputs: List[str]):
+    started = time.perf_counter()
+    _status["state"] = "warming"
+    try:
+        _status["model"] = "loading"
+        try:
+            _timed("import", _import_backend)
+        except Exception:
+            pass  # get_similarity_model reports the failure
+        model = _timed("model_load", evaluation.get_similarity_model)
+        if model is None:
+            _status["model"] = "unavailable"
+            _status["tokenizer"] = "unavailable"
+            _status["embedding_index"] = "unavailable"
+            return
+        _status["model"] = "loaded"
+        _status["backend"] = evaluation.get_similarity_backend()
+
+        tokenizer = getattr(model, "tokenizer", None)
+        if tokenizer is not None:
+            _timed("tokenizer", lambda: tokenizer("warm-up"))
+        _status["tokenizer"] = "loaded" if tokenizer is not None else "unavailable"
+
+        # The first encode pays for lazy kernel and thread pool initialization
+        _timed("first_encode", lambda: model.encode(["warm-up"]))
+        _timed("batcher", evaluation.get_embedding_batcher)
+
+        _status["embedding_index"] = "building"
+        encoded = _timed("embedding_index", lambda: evaluation.build_expected_output_index(expected_outputs))
+        _status["embedding_index"] = "ready"
+        _status["embedding_index_entries"] = len(evaluation.get_expected_output_index())
+        _status["embedding_index_encoded"] = encoded
+    except Exception as e:
+        _status["error"] = str(e)
+        print(f"Warning: Model warm-up failed: {e}")
+    finally:
+        _timings["total"] = round((time.perf_counter() - started) * 1000, 1)
+        _status["state"] = "ready"
+        print(f"Model warm-up finished: {format_timing_report()}")
+
+
+def start_warmup(expected_outputs: Iterable[str]) -> threading.Thread:
+    """Load the similarity model and embedding index in a background thread"""
+    global _thread
+    with _lock:
+        if _thread is None:
+            _thread = threading.Thread(
+                target=_warm_up, args=(list(expected_outputs),), name="model-warmup", daemon=True
+            )
+            _thread.start()
+    return _thread
+
+
+def skip_warmup():
+    """Warm-up disabled: ready at once, the model loads on the first request that needs it"""
+    with _lock:
+        if _thread is None and _status["state"] == "pending":
+            _status.update(state="ready", model="lazy", tokenizer="lazy", embedding_index="lazy")
+
+
+def is_ready() -> bool:
+    return _status["state"] == "ready"
+
+
+def readiness() -> dict:
+    """Warm-up status for the /ready endpoint"""
+    return {
+        "ready": is_ready(),
+        **_status,
+        "timings_ms": dict(_timings),
+    }
+
+
+def format_timing_report() -> str:
+    """One-line breakdown of where the warm-up time went"""
+    steps = [f"{step}={value}ms" for step, value in _timings.items() if step != "total"]
+    steps.append(f"encoded {_status['embedding_index_encoded']} expected outputs")
+    return f"total={_timings.get('total', 0)}ms (" + ", ".join(steps) + ")"
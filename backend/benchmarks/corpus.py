@@ -0,0 +1,83 @@
+"""Seeded synthetic corpus of prompts, outputs and code submissions"""
+import json
+import random
+from typing import Dict, List
+
+ROLES = ["Act as a", "You are a", "As an experienced", "Persona: a", "You will be a"]
+PROFESSIONS = ["marketer", "teacher", "data analyst", "travel writer", "software engineer", "nutritionist", "historian"]
+TASKS = ["Write", "Create", "Generate", "Describe", "Explain", "Summarize", "Draft", "List"]
+SUBJECTS = [
+    "a welcome email for new users of a fitness app",
+    "the causes of the French Revolution",
+    "a recipe for a quick vegetarian dinner",
+    "how recursion works in Python",
+    "a product description for noise cancelling headphones",
+    "the benefits of regular exercise",
+    "a weekly study plan for a chemistry exam",
+    "the water cycle",
+]
+FORMATS = ["Format: bullet points.", "Return a JSON object.", "Output: a markdown table.", "Write in one paragraph.", ""]
+CONSTRAINTS = ["Length: 200 words.", "Tone: professional.", "Keep it short and concise.", "Style: casual.", ""]
+AUDIENCES = ["Audience: beginners.", "for students", "Context: a business meeting.", "targeted at experts", ""]
+FILLER = (
+    "the quick brown fox jumps over lazy dog while data flows through simple clear steps "
+    "and every good answer explains ideas with examples users enjoy reading each morning"
+).split()
+
+CODE_TEMPLATES = [
+    ("def main(a, b):\n    return a + b", lambda a, b: a + b),
+    ("def main(a, b):\n    return a * b", lambda a, b: a * b),
+    ("def main(a, b):\n    return max(a, b)", lambda a, b: max(a, b)),
+    ("def main(a, b):\n    total = 0\n    for i in range(a):\n        total += b\n    return total", lambda a, b: a * b),
+]
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(FILLER) for _ in range(words)).capitalize() + "."
+
+
+def make_prompts(size: int, seed: int = 0) -> List[Dict]:
+    """
+    `size` evaluation items (prompt, generated_output, expected_output,
+    challenge_type). Prompts mix the rule-engine signals at random, and
+    expected outputs repeat across items the way challenges do.
+    """
+    rng = random.Random(seed)
+    expected_pool = [" ".join(_sentence(rng, rng.randint(8, 20)) for _ in range(3)) for _ in range(20)]
+    items = []
+    for _ in range(size):
+        parts = []
+        if rng.random() < 0.6:
+            parts.append(f"{rng.choice(ROLES)} {rng.choice(PROFESSIONS)}.")
+        parts.append(f"{rng.choice(TASKS)} {rng.choice(SUBJECTS)}.")
+        parts += [rng.choice(FORMATS), rng.choice(CONSTRAINTS), rng.choice(AUDIENCES)]
+        if rng.random() < 0.5:
+            parts.append(_sentence(rng, rng.randint(5, 30)))
+        expected = rng.choice(expected_pool)
+        # Generated outputs share a random fraction of the expected output's words
+        shared = expected.split()[: rng.randint(0, len(expected.split()))]
+        generated = " ".join(shared + [_sentence(rng, rng.randint(5, 40))])
+        items.append({
+            "prompt": " ".join(part for part in parts if part),
+            "generated_output": generated,
+            "expected_output": expected,
+            "challenge_type": rng.choice(["text", "image", "code"]),
+        })
+    return items
+
+
+def make_code_submissions(size: int, seed: int = 0, cases: int = 3) -> List[Dict]:
+    """`size` code submissions with JSON test cases; roughly a quarter fail one case"""
+    rng = random.Random(seed)
+    submissions = []
+    for _ in range(size):
+        code, reference = rng.choice(CODE_TEMPLATES)
+        test_cases = []
+        for _ in range(cases):
+            a, b = rng.randint(0, 50), rng.randint(0, 50)
+            expected = reference(a, b)
+            if rng.random() < 0.08:
+                expected += 1
+            test_cases.append({"input": {"a": a, "b": b}, "expected": expected})
+        submissions.append({"code": code, "test_cases": json.dumps(test_cases)})
+    return submissions
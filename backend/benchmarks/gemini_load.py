@@ -0,0 +1,115 @@
+"""
+Load test for the Gemini routes against a local stub of the Gemini API.
+
+    python -m benchmarks.gemini_load --requests 200 --concurrency 50 --delay 0.2
+
+The stub answers every generateContent call after `--delay` seconds. The
+app runs in-process on this script's event loop while a probe task ticks
+every few milliseconds; its worst overshoot is how long the loop stalled.
+With non-blocking upstream calls it stays near zero however slow the stub is.
+"""
+import argparse
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import httpx
+import numpy as np
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app.main import app
+from app.routers import gemini
+from app.services import genai_client
+
+PROBE_INTERVAL = 0.005
+
+
+def stub_app(delay: float) -> Starlette:
+    async def generate(request):
+        await asyncio.sleep(delay)
+        return JSONResponse({"candidates": [{"content": {"role": "model", "parts": [{"text": "stub"}]}}]})
+
+    return Starlette(routes=[Route("/{path:path}", generate, methods=["POST"])])
+
+
+def start_stub(delay: float) -> str:
+    """Serve the stub on a free local port from a background thread; returns its base URL"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(stub_app(delay), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+async def probe_loop_lag(stop: asyncio.Event) -> float:
+    """Worst delay, in seconds, between when a tick was due and when it ran"""
+    worst = 0.0
+    while not stop.is_set():
+        due = time.monotonic() + PROBE_INTERVAL
+        await asyncio.sleep(PROBE_INTERVAL)
+        worst = max(worst, time.monotonic() - due)
+    return worst
+
+
+async def run_load(requests: int, concurrency: int) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=None) as client:
+        async def one(i: int):
+            async with gate:
+                started = time.monotonic()
+                response = await client.post("/gemini/generate-text", json={"prompt": f"prompt {i}"})
+                response.raise_for_status()
+                latencies.append(time.monotonic() - started)
+
+        stop = asyncio.Event()
+        probe = asyncio.ensure_future(probe_loop_lag(stop))
+        started = time.monotonic()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.monotonic() - started
+        stop.set()
+        worst_lag = await probe
+
+    values = np.array(latencies) * 1000
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(requests / elapsed, 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "max_loop_lag_ms": round(worst_lag * 1000, 2),
+        "models": gemini.model_limiter.stats(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test /gemini/generate-text against a local stub")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.2, help="seconds the stub takes per call")
+    args = parser.parse_args(argv)
+
+    genai_client.GENAI_BASE_URL = start_stub(args.delay)
+    client = genai_client.create_genai_client(api_key="stub")
+    app.dependency_overrides[gemini.genai_client] = lambda: client
+    try:
+        report = asyncio.run(run_load(args.requests, args.concurrency))
+    finally:
+        client.close()
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
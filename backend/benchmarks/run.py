@@ -0,0 +1,292 @@
+"""
+Benchmarks for the evaluation and code execution hot paths.
+
+    python -m benchmarks.run --sizes 100,1000 --seed 0
+    python -m benchmarks.run --save-baseline       # record benchmarks/baseline.json
+    python -m benchmarks.run --compare             # fail on p95 regressions vs the baseline
+
+Every stage runs over the same seeded synthetic corpus and reports
+throughput plus p50/p95/p99 latency. Runs are offline: the Hugging Face hub
+is not contacted and a deterministic stub encoder stands in for MiniLM when
+it is not cached (--model stub forces it).
+"""
+import os
+
+# Must be set before transformers / huggingface_hub are imported
+os.environ.setdefault("HF_HUB_OFFLINE", "1")
+os.environ.setdefault("TRANSFORMERS_OFFLINE", "1")
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.services import evaluation, llm_integration
+from app.services.embedding_index import EmbeddingIndex
+from app.services.llm_integration import execute_code_safely
+from app.services.result_cache import ResultCache
+
+from .corpus import make_code_submissions, make_prompts
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+DEFAULT_OUTPUT = os.path.join(BENCHMARK_DIR, "results", "latest.json")
+BATCH_CHUNK_SIZE = 256
+STAGES = [
+    "rule_based_score",
+    "similarity_score",
+    "evaluate_prompt",
+    "evaluate_prompt_cached",
+    "evaluate_prompts_batch",
+    "execute_code_safely",
+]
+
+
+class StubEncoder:
+    """Deterministic hashed bag-of-words embeddings, shaped like MiniLM's"""
+
+    dimensions = 384
+
+    def encode(self, sentences, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        if single:
+            sentences = [sentences]
+        vectors = np.zeros((len(sentences), self.dimensions), dtype=np.float32)
+        for row, sentence in enumerate(sentences):
+            for token in sentence.lower().split():
+                vectors[row, zlib.crc32(token.encode("utf-8")) % self.dimensions] += 1.0
+        return vectors[0] if single else vectors
+
+
+def setup_model(mode: str, index_dir: str) -> str:
+    """
+    Point the evaluation module at the real model (if cached) or the stub,
+    with a scratch embedding index and an empty result cache.
+    Returns the similarity backend in use.
+    """
+    model, backend = None, None
+    if mode != "stub":
+        model = evaluation.get_similarity_model()
+        backend = evaluation.get_similarity_backend()
+        if model is None and mode == "real":
+            raise SystemExit(f"{evaluation.SIMILARITY_MODEL_NAME} is not available offline")
+    if model is None:
+        model, backend = StubEncoder(), "stub"
+
+    evaluation._model = model
+    evaluation._model_backend = backend
+    evaluation._batcher = None
+    evaluation._expected_index = EmbeddingIndex(index_dir, f"{evaluation.SIMILARITY_MODEL_NAME}:{backend}")
+    evaluation.result_cache = ResultCache(max_entries=1_000_000, namespace="benchmark")
+    return backend
+
+
+def summarize(latencies: Sequence[float], items: int, elapsed: float) -> Dict:
+    """Latencies are per call in seconds; throughput is items per second"""
+    values = np.array(latencies, dtype=np.float64) * 1000
+    return {
+        "calls": len(latencies),
+        "items": items,
+        "throughput_per_s": round(items / elapsed, 2) if elapsed > 0 else 0.0,
+        "mean_ms": round(float(values.mean()), 4),
+        "p50_ms": round(float(np.percentile(values, 50)), 4),
+        "p95_ms": round(float(np.percentile(values, 95)), 4),
+        "p99_ms": round(float(np.percentile(values, 99)), 4),
+    }
+
+
+def measure(fn: Callable, calls: Sequence, items_per_call: Optional[Callable] = None) -> Dict:
+    latencies: List[float] = []
+    items = 0
+    started = time.perf_counter()
+    for args in calls:
+        call_started = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - call_started)
+        items += items_per_call(args) if items_per_call else 1
+    return summarize(latencies, items, time.perf_counter() - started)
+
+
+def run_size(size: int, seed: int, exec_size: int, stages: Sequence[str]) -> Dict[str, Dict]:
+    corpus = make_prompts(size, seed)
+    rule_args = [(item["prompt"], item["challenge_type"]) for item in corpus]
+    similarity_args = [(item["generated_output"], item["expected_output"]) for item in corpus]
+    evaluate_args = [
+        (item["prompt"], item["generated_output"], item["expected_output"], item["challenge_type"])
+        for item in corpus
+    ]
+    chunks = [(corpus[i:i + BATCH_CHUNK_SIZE],) for i in range(0, size, BATCH_CHUNK_SIZE)]
+
+    # The app precomputes expected outputs at startup; do the same, then warm each path once
+    evaluation.build_expected_output_index(sorted({item["expected_output"] for item in corpus}))
+    evaluation.rule_based_score(*rule_args[0])
+    evaluation.similarity_score(*similarity_args[0])
+    evaluation.result_cache.clear()
+
+    results = {}
+    if "rule_based_score" in stages:
+        results["rule_based_score"] = measure(evaluation.rule_based_score, rule_args)
+    if "similarity_score" in stages:
+        results["similarity_score"] = measure(evaluation.similarity_score, similarity_args)
+    if "evaluate_prompt" in stages:
+        results["evaluate_prompt"] = measure(evaluation.evaluate_prompt, evaluate_args)
+    if "evaluate_prompt_cached" in stages:
+        if "evaluate_prompt" not in stages:
+            for args in evaluate_args:
+                evaluation.evaluate_prompt(*args)
+        results["evaluate_prompt_cached"] = measure(evaluation.evaluate_prompt, evaluate_args)
+    if "evaluate_prompts_batch" in stages:
+        results["evaluate_prompts_batch"] = measure(
+            evaluation.evaluate_prompts_batch, chunks, items_per_call=lambda args: len(args[0])
+        )
+    if "execute_code_safely" in stages and exec_size > 0:
+        submissions = make_code_submissions(min(size, exec_size), seed)
+        # Measure the sandbox, not resubmissions answered from the execution cache
+        llm_integration.execution_cache = ResultCache(max_entries=1, ttl_seconds=0, namespace="benchmark")
+        results["execute_code_safely"] = measure(
+            execute_code_safely,
+            [(s["code"], s["test_cases"]) for s in submissions],
+            items_per_call=lambda args: len(json.loads(args[1])),
+        )
+    evaluation.result_cache.clear()
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=BENCHMARK_DIR, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_suite(
+    sizes: Sequence[int],
+    seed: int = 0,
+    exec_size: int = 20,
+    model: str = "auto",
+    stages: Sequence[str] = STAGES,
+) -> Dict:
+    with tempfile.TemporaryDirectory() as index_dir:
+        backend = setup_model(model, index_dir)
+        results = {str(size): run_size(size, seed, exec_size, stages) for size in sizes}
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "similarity_backend": backend,
+            "seed": seed,
+            "sizes": list(sizes),
+            "exec_size": exec_size,
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float = 0.25) -> List[Dict]:
+    """
+    Stage-by-stage comparison against a baseline run.
+    A stage regresses when its p95 latency grew by more than `tolerance`.
+    """
+    rows = []
+    for size, stages in current["results"].items():
+        for stage, stats in stages.items():
+            previous = baseline.get("results", {}).get(size, {}).get(stage)
+            if not previous or not previous["p95_ms"]:
+                continue
+            p95_change = stats["p95_ms"] / previous["p95_ms"] - 1
+            throughput_change = (
+                stats["throughput_per_s"] / previous["throughput_per_s"] - 1 if previous["throughput_per_s"] else 0.0
+            )
+            rows.append({
+                "size": size,
+                "stage": stage,
+                "p95_change": round(p95_change, 4),
+                "throughput_change": round(throughput_change, 4),
+                "regressed": p95_change > tolerance,
+            })
+    return rows
+
+
+def format_report(report: Dict) -> str:
+    meta = report["meta"]
+    lines = [f"commit={meta['commit']} backend={meta['similarity_backend']} seed={meta['seed']}"]
+    lines.append(f"{'size':>6}  {'stage':<24}{'items/s':>12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for size, stages in report["results"].items():
+        for stage, stats in stages.items():
+            lines.append(
+                f"{size:>6}  {stage:<24}{stats['throughput_per_s']:>12.1f}"
+                f"{stats['p50_ms']:>10.3f}{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}"
+            )
+    return "\n".join(lines)
+
+
+def format_comparison(rows: List[Dict], baseline: Dict) -> str:
+    lines = [f"vs baseline {baseline.get('meta', {}).get('commit')}:"]
+    for row in rows:
+        flag = "  REGRESSION" if row["regressed"] else ""
+        lines.append(
+            f"{row['size']:>6}  {row['stage']:<24} p95 {row['p95_change']:+.1%}  "
+            f"throughput {row['throughput_change']:+.1%}{flag}"
+        )
+    return "\n".join(lines)
+
+
+def write_json(path: str, data: Dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+        f.write("\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the evaluation and execution hot paths")
+    parser.add_argument("--sizes", default="100,1000", help="comma separated corpus sizes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--exec-size", type=int, default=20, help="code submissions per size, 0 to skip execution")
+    parser.add_argument("--model", choices=["auto", "stub", "real"], default="auto")
+    parser.add_argument("--stages", default=",".join(STAGES), help="comma separated stages to run")
+    parser.add_argument("-o", "--output", default=DEFAULT_OUTPUT, help="where to write this run's JSON")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="also store this run as the baseline")
+    parser.add_argument("--compare", action="store_true", help="compare against the baseline, exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 growth before flagging")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    stages = [stage for stage in args.stages.split(",") if stage in STAGES]
+    report = run_suite(sizes, args.seed, args.exec_size, args.model, stages)
+    print(format_report(report))
+    write_json(args.output, report)
+    if args.save_baseline:
+        write_json(args.baseline, report)
+        print(f"Baseline saved to {args.baseline}")
+
+    if args.compare:
+        if not os.path.exists(args.baseline):
+            print(f"No baseline at {args.baseline}", file=sys.stderr)
+            return 1
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("meta", {}).get("similarity_backend") != report["meta"]["similarity_backend"]:
+            print("Warning: baseline was recorded with a different similarity backend")
+        rows = compare(report, baseline, args.tolerance)
+        print(format_comparison(rows, baseline))
+        if any(row["regressed"] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
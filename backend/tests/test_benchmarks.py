@@ -0,0 +1,34 @@
+import pytest
+
+from app.services import evaluation
+from benchmarks import run
+from benchmarks.corpus import make_prompts
+
+
+@pytest.fixture
+def restore_evaluation(monkeypatch):
+    for name in ("_model", "_model_backend", "_batcher", "_expected_index", "result_cache"):
+        monkeypatch.setattr(evaluation, name, getattr(evaluation, name))
+
+
+def test_corpus_is_seeded():
+    assert make_prompts(20, seed=3) == make_prompts(20, seed=3)
+    assert make_prompts(20, seed=3) != make_prompts(20, seed=4)
+
+
+def test_suite_reports_percentiles_and_compares(restore_evaluation):
+    stages = ["rule_based_score", "evaluate_prompt", "evaluate_prompts_batch"]
+    report = run.run_suite([30], seed=1, exec_size=0, model="stub", stages=stages)
+
+    assert report["meta"]["similarity_backend"] == "stub"
+    results = report["results"]["30"]
+    assert sorted(results) == sorted(stages)
+    for stats in results.values():
+        assert stats["p50_ms"] <= stats["p95_ms"] <= stats["p99_ms"]
+        assert stats["throughput_per_s"] > 0
+    assert results["evaluate_prompts_batch"]["items"] == 30
+
+    slower = {"results": {"30": {s: dict(v, p95_ms=v["p95_ms"] * 2) for s, v in results.items()}}}
+    rows = run.compare(slower, report, tolerance=0.25)
+    assert len(rows) == 3 and all(row["regressed"] for row in rows)
+    assert not any(row["regressed"] for row in run.compare(report, report))
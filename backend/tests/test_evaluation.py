@@ -0,0 +1,247 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from app.services import evaluation, rule_engine
+from app.services.embedding_batcher import EmbeddingBatcher
+from app.services.embedding_index import EmbeddingIndex
+from app.services.evaluation_pool import EvaluationPool
+from app.services.lexical import LexicalIndex
+from app.services.evaluation import rule_based_score
+from app.services.result_cache import ResultCache
+from app.services.rule_engine import KeywordRuleSet, has_min_words
+from app.routers import submissions
+from app.routers.submissions import rule_based_score as submission_rule_score
+
+
+def test_rule_set_finds_overlapping_categories():
+    rules = KeywordRuleSet({"format": ["format:"], "audience": ["for"], "role": ["act as"]})
+    assert rules.find("format: table") == {"format", "audience"}
+    assert rules.find("please act as a guide") == {"role"}
+    assert rules.find("nothing here") == set()
+
+
+def test_rule_set_matches_substring_scan(monkeypatch):
+    categories = {"a": ["as a", "you are"], "b": ["json", "list"], "c": ["son", "a list"]}
+    texts = ["", "you are a json list", "reason as a listener", "a lis", "persona"]
+    expected = [{name for name, words in categories.items() if any(w in t for w in words)} for t in texts]
+    assert [KeywordRuleSet(categories).find(t) for t in texts] == expected
+    monkeypatch.setattr(rule_engine, "ahocorasick", None)
+    assert [KeywordRuleSet(categories).find(t) for t in texts] == expected
+
+
+def test_has_min_words():
+    assert has_min_words("one two  three\nfour", 4)
+    assert not has_min_words("one two", 3)
+    assert has_min_words("", 0)
+
+
+def test_rule_based_score_full_prompt():
+    prompt = "You are a teacher. Write a brief list of exam tips for students, in a formal tone."
+    score, suggestions = rule_based_score(prompt, "script")
+    assert score == 10
+    assert suggestions == []
+
+
+def test_submission_rule_score_order():
+    score, feedback, improvements = submission_rule_score("hello")
+    assert score == 0
+    assert feedback == []
+    assert len(improvements) == 5
+    assert improvements[0].startswith("Try assigning a role")
+
+
+class CountingEncoder:
+    def __init__(self):
+        self.encoded = []
+
+    def __call__(self, texts):
+        self.encoded.extend(texts)
+        return np.array([[len(t), 1.0, 0.0] for t in texts], dtype=np.float32)
+
+
+def test_embedding_index_persists_and_rebuilds_changed(tmp_path):
+    encode = CountingEncoder()
+    index = EmbeddingIndex(str(tmp_path), "test-model")
+    assert index.build(["alpha", "beta"], encode) == 2
+    assert np.isclose(np.linalg.norm(index.get("alpha")), 1.0)
+
+    reopened = EmbeddingIndex(str(tmp_path), "test-model")
+    assert "alpha" in reopened and len(reopened) == 2
+    assert reopened.build(["alpha", "gamma"], encode) == 1
+    assert encode.encoded == ["alpha", "beta", "gamma"]
+    assert "beta" not in reopened
+
+    # Texts the index wasn't built with are encoded together and not persisted
+    encode.encoded.clear()
+    vectors = reopened.lookup_many(["alpha", "delta", "epsilon", "delta"], encode)
+    assert encode.encoded == ["delta", "epsilon"]
+    assert np.allclose(vectors["alpha"], reopened.get("alpha"))
+    assert np.isclose(np.linalg.norm(reopened.lookup("delta", encode)), 1.0)
+    assert len(EmbeddingIndex(str(tmp_path), "test-model")) == 2
+    assert len(EmbeddingIndex(str(tmp_path), "other-model")) == 0
+
+
+def test_batch_similarity_encodes_unindexed_expected_outputs_in_one_call(monkeypatch, tmp_path):
+    calls = []
+
+    class Model:
+        def encode(self, texts):
+            calls.append(len(texts))
+            return np.array([[len(t), 1.0] for t in texts], dtype=np.float32)
+
+    index = EmbeddingIndex(str(tmp_path), "test-model")
+    index.build(["indexed"], Model().encode)
+    calls.clear()
+    monkeypatch.setattr(evaluation, "_model", Model())
+    monkeypatch.setattr(evaluation, "_batcher", SimpleNamespace(encode=Model().encode))
+    monkeypatch.setattr(evaluation, "_expected_index", index)
+
+    expected = ["indexed"] + [f"expected {i}" for i in range(1000)]
+    scores = evaluation.similarity_scores_batch(["generated"] * len(expected), expected)
+    assert len(scores) == 1001 and all(0 <= score <= 10 for score in scores)
+    # The expected outputs the index didn't hold, then every generated output
+    assert calls == [1000, 1001]
+    assert len(EmbeddingIndex(str(tmp_path), "test-model")) == 1
+
+
+def test_batch_similarity_falls_back_to_keyword_scores(monkeypatch):
+    monkeypatch.setattr(evaluation, "_model", False)
+    monkeypatch.setattr(evaluation, "_batcher", None)
+    generated = ["a red rose", "golden beach", "", "x y"]
+    expected = [f"a red rose number {i}" for i in range(3)] + ["x y z"]
+    scores = evaluation.similarity_scores_batch(generated, expected)
+    assert scores == pytest.approx([10 * 3 / 5, 0.0, 5.0, 10 * 2 / 3])
+
+
+def test_evaluation_pool_starts_preloaded_workers():
+    pool = EvaluationPool(workers=1, max_queue=1)
+    try:
+        pool.start(preload=["app.routers.submissions"])
+        assert len(pool._executor._processes) == 1
+        # Checked from inside the worker, before any real job has imported it
+        loaded = pool.submit(eval, "'app.routers.submissions' in __import__('sys').modules").result(timeout=60)
+        assert loaded is True
+        assert pool.stats()["completed"] == 1  # the priming jobs aren't counted
+    finally:
+        pool.shutdown()
+
+
+def test_evaluation_pool_replaces_workers_after_one_dies(monkeypatch):
+    pool = EvaluationPool(workers=1, max_queue=1)
+    monkeypatch.setattr(submissions, "evaluation_pool", pool)
+    try:
+        with pytest.raises(HTTPException) as error:
+            asyncio.run(submissions.run_evaluation(os._exit, 1))
+        assert error.value.status_code == 503
+        assert pool.submit(abs, -3).result(timeout=60) == 3
+        assert pool.stats()["failed"] == 1
+    finally:
+        pool.shutdown()
+
+
+def test_evaluation_pool_drops_results_of_cancelled_jobs(caplog):
+    pool = EvaluationPool(workers=0, max_queue=1)
+    release = threading.Event()
+    try:
+        future = pool.submit(release.wait)
+        assert future.cancel()
+        release.set()
+        assert pool.submit(abs, -1).result(timeout=10) == 1
+        assert pool.stats()["completed"] == 2
+        assert not [r for r in caplog.records if r.levelno >= logging.ERROR]
+    finally:
+        pool.shutdown()
+
+
+def test_embedding_batcher_merges_concurrent_requests():
+    calls = []
+
+    def encode(texts):
+        calls.append(list(texts))
+        return np.array([[float(len(t))] for t in texts])
+
+    batcher = EmbeddingBatcher(encode, max_batch_size=64, max_wait_ms=50)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda t: batcher.encode([t, t + t]), ["a", "bb", "ccc", "dddd"]))
+    batcher.close()
+
+    assert [r[:, 0].tolist() for r in results] == [[1, 2], [2, 4], [3, 6], [4, 8]]
+    assert sum(len(c) for c in calls) == 8
+    assert len(calls) < 4
+    assert batcher.stats()["texts"] == 8
+
+
+def test_result_cache_lru_ttl_and_disk_tier(tmp_path):
+    db_path = str(tmp_path / "cache.db")
+    cache = ResultCache(max_entries=2, ttl_seconds=60, db_path=db_path)
+    cache.set("a", {"score": 1})
+    cache.set("b", {"score": 2})
+    assert cache.get("a") == {"score": 1}
+    cache.set("c", {"score": 3})
+    assert cache.stats()["evictions"] == 1
+    assert cache.get("b") == {"score": 2}  # evicted from memory, served from SQLite
+    assert cache.stats()["disk_hits"] == 1
+
+    cache.set("stale", {"score": 0}, ttl_seconds=-1)
+    assert cache.get("stale") is None
+    assert ResultCache(db_path=db_path).get("c") == {"score": 3}
+
+
+def test_evaluate_prompt_is_cached_per_scorer_version(monkeypatch):
+    monkeypatch.setattr(evaluation, "_model", False)
+    monkeypatch.setattr(evaluation, "result_cache", ResultCache())
+    first = evaluation.evaluate_prompt("You are a poet", "a red rose", "a red rose blooms", "script")
+    first["suggestions"].append("mutated by caller")
+    second = evaluation.evaluate_prompt("You are a poet", "a red rose", "a red rose blooms", "script")
+    assert "mutated by caller" not in second["suggestions"]
+    assert evaluation.result_cache.stats()["hits"] == 1
+
+    monkeypatch.setattr(evaluation, "SCORER_VERSION", "test-bump")
+    evaluation.evaluate_prompt("You are a poet", "a red rose", "a red rose blooms", "script")
+    assert evaluation.result_cache.stats()["misses"] == 2
+
+
+def test_lexical_index_matches_pairwise_scores():
+    references = {1: "A golden sunset over the beach", 2: "def fibonacci(n): return seq", 3: "the a"}
+    index = LexicalIndex(references)
+    texts = ["golden beach at sunset", "def fibonacci(n): pass", "", "the A"]
+
+    overlap = index.score_batch(texts, [1, 2, 3])
+    assert overlap.shape == (4, 3)
+    assert overlap[0, 0] == pytest.approx(10 * 3 / 4)  # golden, sunset, beach of 4 non-stop words
+    assert overlap[1, 1] == pytest.approx(10 * 2 / 4)
+    assert not overlap[:, 2].any()  # only stop words in the reference
+
+    jaccard = index.score_pairs(texts, [1, 2, 1, 3], metric="jaccard")
+    assert jaccard.tolist() == pytest.approx([10 * 3 / 7, 10 * 2 / 5, 0.0, 10.0])
+    assert index.score(texts[0], 1) == overlap[0, 0]
+
+
+def test_lexical_index_matches_word_sets_after_many_adds():
+    rng = np.random.default_rng(0)
+    words = [f"w{i}" for i in range(50)] + ["the", "a"]
+    references = {k: " ".join(rng.choice(words, 6)) for k in range(200)}
+    index = LexicalIndex()
+    for key, text in references.items():
+        index.add(key, text)
+    index.add(0, "the w1 w2")  # replacing a key keeps one row for it
+    references[0] = "the w1 w2"
+    texts = [" ".join(rng.choice(words, 5)) for _ in range(20)] + ["unseen words only"]
+    keys = list(references)
+
+    def jaccard(a, b):
+        a, b = set(a.split()), set(b.split())
+        return 10 * len(a & b) / len(a | b)
+
+    batch = index.score_batch(texts, keys, metric="jaccard")
+    assert batch == pytest.approx(np.array([[jaccard(t, references[k]) for k in keys] for t in texts]))
+    pairs = index.score_pairs(texts, keys[:len(texts)], metric="jaccard")
+    assert pairs == pytest.approx([batch[i, i] for i in range(len(texts))])
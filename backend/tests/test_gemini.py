@@ -0,0 +1,317 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.routers import gemini
+from app.services import genai_client
+from app.services.blob_store import BlobStore
+from app.services.genai_client import ModelLimiter
+from app.services.model_chain import ModelChain
+from app.services.result_cache import ResultCache
+from app.services.single_flight import SingleFlight
+
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n"
+
+
+class FakeModels:
+    """Stands in for client.aio.models, answering after `delay` seconds"""
+
+    def __init__(self, delay=0.0, failing=()):
+        self.delay = delay
+        self.failing = set(failing)
+        self.calls = []
+
+    async def generate_content(self, model, contents, **kwargs):
+        self.calls.append(model)
+        await asyncio.sleep(self.delay)
+        if model in self.failing:
+            raise RuntimeError(f"{model} is down")
+        return SimpleNamespace(text=f"{model}: {contents}")
+
+    async def generate_images(self, model, prompt, **kwargs):
+        self.calls.append(model)
+        image = SimpleNamespace(image_bytes=PNG_HEADER + prompt.encode())
+        return SimpleNamespace(generated_images=[SimpleNamespace(image=image)])
+
+    async def generate_content_stream(self, model, contents, **kwargs):
+        self.calls.append(model)
+        if model in self.failing:
+            raise RuntimeError(f"{model} is down")
+
+        async def chunks():
+            try:
+                for word in f"{model}: {contents}".split(" "):
+                    await asyncio.sleep(self.delay)
+                    yield SimpleNamespace(text=word + " ")
+            finally:
+                self.closed = True
+
+        self.closed = False
+        return chunks()
+
+
+def fake_models_client(models):
+    return SimpleNamespace(aio=SimpleNamespace(models=models))
+
+
+@pytest.fixture
+def fake_models(monkeypatch, tmp_path):
+    models = FakeModels()
+    monkeypatch.setattr(gemini, "model_limiter", ModelLimiter(limit=2))
+    monkeypatch.setattr(gemini, "text_cache", ResultCache(namespace="test"))
+    monkeypatch.setattr(gemini, "text_chain", ModelChain(gemini.TEXT_MODELS))
+    monkeypatch.setattr(gemini, "image_chain", ModelChain(gemini.IMAGE_MODELS))
+    monkeypatch.setattr(gemini, "text_flights", SingleFlight())
+    monkeypatch.setattr(gemini, "image_flights", SingleFlight())
+    monkeypatch.setattr(gemini, "image_store", BlobStore(str(tmp_path / "images"), max_bytes=1024 * 1024))
+    monkeypatch.setattr(gemini, "stream_stats", dict.fromkeys(gemini.stream_stats, 0))
+    app.dependency_overrides[gemini.genai_client] = lambda: fake_models_client(models)
+    yield models
+    app.dependency_overrides.pop(gemini.genai_client, None)
+
+
+def test_generate_text_uses_injected_client(fake_models):
+    client = TestClient(app)
+    response = client.post("/gemini/generate-text", json={"prompt": "hello"})
+    assert response.status_code == 200
+    assert response.json() == {"generated_text": "gemini-1.5-flash: hello"}
+
+    fake_models.failing.add("gemini-1.5-flash")
+    response = client.post("/gemini/generate-text", json={"prompt": "hello again"})
+    assert response.json() == {"generated_text": "gemini-pro: hello again"}
+
+
+def test_repeated_prompts_are_served_from_cache(fake_models):
+    client = TestClient(app)
+    first = client.post("/gemini/generate-text", json={"prompt": "Describe  a sunset"})
+    repeat = client.post("/gemini/generate-text", json={"prompt": " Describe a sunset\n"})
+    assert (first.headers["X-Cache"], repeat.headers["X-Cache"]) == ("MISS", "HIT")
+    assert repeat.json() == first.json()
+    assert len(fake_models.calls) == 1
+
+    bypass = client.post(
+        "/gemini/generate-text", json={"prompt": "Describe a sunset"}, headers={"Cache-Control": "no-cache"}
+    )
+    assert bypass.headers["X-Cache"] == "BYPASS"
+    assert len(fake_models.calls) == 2
+    stats = client.get("/gemini/stats").json()["text_cache"]
+    assert (stats["hits"], stats["misses"], stats["hit_ratio"]) == (1, 1, 0.5)
+
+
+def test_breaker_skips_a_failing_model_until_a_probe_succeeds(fake_models):
+    client = TestClient(app)
+    breaker = gemini.text_chain.breakers["gemini-1.5-flash"]
+    breaker.recovery_seconds = breaker._backoff = 0.2
+    fake_models.failing.add("gemini-1.5-flash")
+    for i in range(3):
+        assert client.post("/gemini/generate-text", json={"prompt": f"p{i}"}).status_code == 200
+    assert breaker.state == "open"
+
+    # Straight to the fallback while open
+    fake_models.calls.clear()
+    assert client.post("/gemini/generate-text", json={"prompt": "p3"}).json() == {"generated_text": "gemini-pro: p3"}
+    assert fake_models.calls == ["gemini-pro"]
+
+    time.sleep(0.3)
+    fake_models.failing.clear()
+    assert client.post("/gemini/generate-text", json={"prompt": "p4"}).json()["generated_text"].startswith("gemini-1.5")
+    stats = client.get("/gemini/stats").json()["breakers"]["text"]["gemini-1.5-flash"]
+    assert stats["state"] == "closed" and stats["short_circuited"] == 1
+    assert [(t["from"], t["to"]) for t in stats["transitions"]] == [
+        ("closed", "open"), ("open", "half_open"), ("half_open", "closed"),
+    ]
+
+    fake_models.failing.update(gemini.TEXT_MODELS)
+    assert client.post("/gemini/generate-text", json={"prompt": "p5"}).status_code == 500
+    for breaker in gemini.text_chain.breakers.values():
+        breaker._open("test")
+    assert client.post("/gemini/generate-text", json={"prompt": "p6"}).status_code == 503
+
+
+def test_slow_upstream_neither_blocks_the_loop_nor_exceeds_the_model_limit(fake_models):
+    fake_models.delay = 0.3
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            started = time.monotonic()
+            generations = [
+                asyncio.ensure_future(client.post("/gemini/generate-text", json={"prompt": str(i)})) for i in range(4)
+            ]
+            await asyncio.sleep(0.05)
+            # Other routes answer while every generation is waiting on upstream
+            assert (await client.get("/")).status_code == 200
+            assert time.monotonic() - started < 0.25
+            responses = await asyncio.gather(*generations)
+            elapsed = time.monotonic() - started
+            return responses, elapsed, (await client.get("/gemini/stats")).json()
+
+    responses, elapsed, stats = asyncio.run(scenario())
+    assert all(response.status_code == 200 for response in responses)
+    # Two slots for four calls: two rounds, not four
+    assert 0.55 < elapsed < 1.0
+    model = stats["models"]["gemini-1.5-flash"]
+    assert (model["calls"], model["queued"], model["in_flight"], model["limit"]) == (4, 2, 0, 2)
+    assert model["wait_ms_max"] >= 250
+
+
+def _events(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_stream_relays_chunks_then_the_assembled_text(fake_models):
+    client = TestClient(app)
+    fake_models.failing.add("gemini-1.5-flash")
+    response = client.post("/gemini/generate-text/stream", json={"prompt": "tell me a story"})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = _events(response.text)
+    assert [e for e, _ in events] == ["chunk"] * 5 + ["done"]
+    done = events[-1][1]
+    assert done["generated_text"] == "".join(data["text"] for _, data in events[:-1])
+    assert done["generated_text"] == "gemini-pro: tell me a story "
+    assert done["model"] == "gemini-pro" and done["ttft_ms"] >= 0
+
+    # The assembled text is cached for /generate-text too
+    cached = client.post("/gemini/generate-text", json={"prompt": "tell me a story"})
+    assert cached.headers["X-Cache"] == "HIT"
+    assert cached.json() == {"generated_text": done["generated_text"]}
+    stats = client.get("/gemini/stats").json()
+    assert stats["streams"]["completed"] == 1
+    assert stats["models"]["gemini-pro"]["in_flight"] == 0
+
+    fake_models.failing.update(gemini.TEXT_MODELS)
+    events = _events(client.post("/gemini/generate-text/stream", json={"prompt": "again"}).text)
+    assert events[0][0] == "error" and events[0][1]["status"] == 500
+
+
+def test_closing_the_stream_closes_upstream_and_frees_the_slot(fake_models):
+    fake_models.delay = 0.01
+
+    async def scenario():
+        events = gemini.text_events(fake_models_client(fake_models), "a long answer", None, None)
+        assert (await events.__anext__()).startswith("event: chunk")
+        # What a client disconnect does to the response's iterator
+        await events.aclose()
+
+    asyncio.run(scenario())
+    assert fake_models.closed
+    assert gemini.model_limiter.stats()["gemini-1.5-flash"]["in_flight"] == 0
+    assert gemini.stream_stats["cancelled"] == 1
+
+
+def test_images_are_stored_once_and_served_by_url(fake_models):
+    client = TestClient(app)
+    url = client.post("/gemini/generate-image", json={"prompt": "a cat"}).json()["image_url"]
+    digest = hashlib.sha256(PNG_HEADER + b"a cat").hexdigest()
+    assert url == f"http://testserver/gemini/images/{digest}"
+    assert gemini.image_store.path(digest).endswith(f"/{digest[:2]}/{digest[2:4]}/{digest}")
+    assert client.post("/gemini/generate-image", json={"prompt": "a cat"}).json()["image_url"] == url
+
+    image = client.get(url)
+    assert image.content == PNG_HEADER + b"a cat"
+    assert image.headers["content-type"] == "image/png"
+    assert image.headers["etag"] == f'"{digest}"'
+    assert "immutable" in image.headers["cache-control"]
+    assert client.get(url, headers={"If-None-Match": image.headers["etag"]}).status_code == 304
+
+    part = client.get(url, headers={"Range": "bytes=8-"})
+    assert (part.status_code, part.content) == (206, b"a cat")
+    assert part.headers["content-range"] == "bytes 8-12/13"
+    assert client.get(url, headers={"Range": "bytes=-3", "If-Range": '"other"'}).status_code == 200
+    assert client.get(url, headers={"Range": "bytes=13-"}).status_code == 416
+    assert client.get("/gemini/images/..%2F..%2Fetc").status_code == 404
+
+    stats = client.get("/gemini/stats").json()["image_store"]
+    assert (stats["writes"], stats["dedup_hits"], stats["bytes"]) == (1, 1, 13)
+
+
+def test_image_store_evicts_least_recently_used_blobs(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=250)
+    first, second = store.put(b"a" * 100), store.put(b"b" * 100)
+    os.utime(store.path(first), (0, 0))
+    os.utime(store.path(second), (1, 1))
+    store.open(first).close()  # reading the first makes the second the oldest
+    third = store.put(b"c" * 100)
+    assert [os.path.exists(store.path(d)) for d in (first, second, third)] == [True, False, True]
+    assert store.stats()["bytes"] == 200 and store.evictions == 1
+    # A fresh store over the same directory picks up its size
+    assert BlobStore(str(tmp_path), max_bytes=250).stats()["bytes"] == 200
+
+
+def test_identical_concurrent_prompts_share_one_upstream_call(fake_models):
+    fake_models.delay = 0.2
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            texts = [client.post("/gemini/generate-text", json={"prompt": p}) for p in ["same", " same ", "other"]]
+            images = [client.post("/gemini/generate-image", json={"prompt": "same"}) for _ in range(3)]
+            responses = await asyncio.gather(*texts, *images)
+            return responses, (await client.get("/gemini/stats")).json()["single_flight"]
+
+    responses, stats = asyncio.run(scenario())
+    assert [r.json()["generated_text"] for r in responses[:3]] == [
+        "gemini-1.5-flash: same", "gemini-1.5-flash: same", "gemini-1.5-flash: other",
+    ]
+    assert len({r.json()["image_url"] for r in responses[3:]}) == 1
+    assert len(fake_models.calls) == 3
+    assert (stats["text"]["executed"], stats["text"]["collapsed"], stats["text"]["in_flight"]) == (2, 1, 0)
+    assert (stats["image"]["executed"], stats["image"]["collapsed"]) == (1, 2)
+
+
+def test_single_flight_shares_errors_and_outlives_cancelled_callers():
+    async def scenario():
+        flights = SingleFlight()
+        runs = []
+
+        async def work(fail=False):
+            runs.append(1)
+            await asyncio.sleep(0.05)
+            if fail:
+                raise RuntimeError("upstream down")
+            return "ok"
+
+        failed = await asyncio.gather(*(flights.do("k", lambda: work(fail=True)) for _ in range(2)), return_exceptions=True)
+        assert [str(e) for e in failed] == ["upstream down"] * 2
+
+        # The caller that started the call leaving doesn't cancel it for the one still waiting
+        leader = asyncio.ensure_future(flights.do("k", work))
+        follower = asyncio.ensure_future(flights.do("k", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == "ok"
+
+        # ...but once nobody is waiting it is cancelled
+        alone = asyncio.ensure_future(flights.do("k", work))
+        await asyncio.sleep(0.01)
+        alone.cancel()
+        await asyncio.sleep(0.01)
+        return runs, flights.stats()
+
+    runs, stats = asyncio.run(scenario())
+    assert len(runs) == 3
+    assert (stats["calls"], stats["executed"], stats["collapsed"], stats["in_flight"]) == (5, 3, 2, 0)
+
+
+def test_shared_client_is_created_once_and_closed(monkeypatch):
+    monkeypatch.setattr(genai_client, "_client", None)
+    monkeypatch.delenv("MODEL_API", raising=False)
+    monkeypatch.setenv("model_api", "test-key")
+
+    client = genai_client.get_genai_client()
+    assert genai_client.get_genai_client() is client
+    asyncio.run(genai_client.close_genai_client())
+    assert genai_client._client is None
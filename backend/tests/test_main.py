@@ -1,6 +1,15 @@
+import json
+import threading
+
+import numpy as np
 import pytest
 from fastapi.testclient import TestClient
+from app import main
 from app.main import app
+from app.routers import submissions
+from app.services import evaluation, llm_integration, warmup
+from app.services.embedding_index import EmbeddingIndex
+from app.services.evaluation_pool import EvaluationPool
 
 client = TestClient(app)
 
@@ -17,4 +26,156 @@ def test_get_problems():
 def test_create_submission():
     response = client.post("/api/submissions", json={"prompt": "Example prompt", "user_id": 1})
     assert response.status_code == 201
-    assert "id" in response.json()
\ No newline at end of file
+    assert "id" in response.json()
+
+
+class StubEncoder:
+    def tokenizer(self, text):
+        return {"input_ids": [[1, 2]]}
+
+    def encode(self, texts):
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+
+def test_ready_reports_warmup_status(monkeypatch, tmp_path):
+    monkeypatch.setattr(evaluation, "_model", StubEncoder())
+    monkeypatch.setattr(evaluation, "_model_backend", "stub")
+    monkeypatch.setattr(evaluation, "_batcher", None)
+    monkeypatch.setattr(evaluation, "_expected_index", EmbeddingIndex(str(tmp_path), "stub"))
+    warmup.start_warmup(["expected output"]).join(timeout=10)
+
+    response = client.get("/ready")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["ready"] is True
+    assert body["model"] == "loaded" and body["embedding_index_entries"] == 1
+    assert "model_load" in body["timings_ms"]
+
+
+def test_ready_without_warmup_on_startup(monkeypatch):
+    monkeypatch.setattr(main, "WARMUP_ON_STARTUP", False)
+    monkeypatch.setattr(warmup, "_thread", None)
+    monkeypatch.setattr(warmup, "_status", {**warmup._status, "state": "pending", "model": "pending"})
+    with TestClient(app) as lifespan_client:
+        response = lifespan_client.get("/ready")
+    assert response.status_code == 200
+    assert (response.json()["state"], response.json()["model"]) == ("ready", "lazy")
+
+
+SUBMISSION = {
+    "challenge_id": 4,
+    "user_prompt": "You are a marketer. Write a short, friendly welcome email for new users of a fitness app.",
+    "generated_output": "Welcome! Set your first fitness goal today.",
+}
+
+
+def test_create_submission_scores_in_pool(monkeypatch):
+    monkeypatch.setattr(submissions, "evaluation_pool", EvaluationPool(workers=0, max_queue=4))
+    response = client.post("/submissions/create", json=SUBMISSION)
+    assert response.status_code == 200
+    assert response.json()["rule_score"] == 8
+    assert client.get("/submissions/pool").json()["completed"] == 1
+
+
+def test_create_submission_sheds_load_when_pool_is_full(monkeypatch):
+    pool = EvaluationPool(workers=0, max_queue=0)
+    release = threading.Event()
+    pool.submit(release.wait)
+    monkeypatch.setattr(submissions, "evaluation_pool", pool)
+    response = client.post("/submissions/create", json=SUBMISSION)
+    release.set()
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert pool.stats()["rejected"] == 1
+
+
+def test_batch_rescore_streams_ndjson(monkeypatch):
+    monkeypatch.setattr(evaluation, "_model", False)
+    lines = [json.dumps({"id": i, **SUBMISSION}) for i in range(5)] + ["not json"]
+    response = client.post(
+        "/submissions/batch?chunk_size=2&rule_weight=1&similarity_weight=0",
+        content="\n".join(lines).encode(),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [r.get("id") for r in results[:5]] == [0, 1, 2, 3, 4]
+    assert all(r["score"] == r["rule_score"] for r in results[:5])
+    assert results[5] == {"line": 6, "error": "Expecting value: line 1 column 1 (char 0)"}
+
+
+def test_batch_rescore_reports_non_string_fields_per_line(monkeypatch):
+    monkeypatch.setattr(evaluation, "_model", False)
+    lines = [
+        json.dumps({**SUBMISSION, "generated_output": 5}),
+        json.dumps({**SUBMISSION, "expected_output": ["a", "b"]}),
+        json.dumps({"id": 2, **SUBMISSION}),
+    ]
+    response = client.post(
+        "/submissions/batch?rule_weight=1&similarity_weight=0",
+        content="\n".join(lines).encode(),
+        headers={"Content-Type": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert results[0] == {"line": 1, "error": "generated_output must be a string"}
+    assert results[1] == {"line": 2, "error": "expected_output must be a string"}
+    assert results[2]["id"] == 2 and "score" in results[2]
+
+
+def test_execute_runs_code_against_test_cases():
+    response = client.post("/submissions/execute", json={
+        "code": "def main(s):\n    return s[::-1]",
+        "test_cases": [{"input": {"s": "abc"}, "expected": "cba"}, {"input": {"s": "ab"}, "expected": "ab"}],
+    })
+    assert response.status_code == 200
+    body = response.json()
+    assert (body["passed"], body["failed"], body["total"]) == (1, 1, 2)
+    assert body["score"] == 5.0
+
+
+def test_execute_rejects_code_too_deep_or_large_to_compile():
+    cases = [{"input": {"n": 1}, "expected": 1}]
+    deep = client.post("/submissions/execute", json={"code": "1+" * 20000 + "1", "test_cases": cases})
+    assert deep.status_code == 200
+    assert deep.json()["error"] == "RecursionError: code is nested too deeply to compile"
+
+    large = client.post("/submissions/execute", json={"code": "1+" * 200000 + "1", "test_cases": cases})
+    assert large.status_code == 200
+    assert large.json()["error"].startswith("Submission is too large: 400001 bytes")
+    assert large.json()["score"] == 0.0
+
+
+def test_execute_handles_malformed_test_cases():
+    code = "def main(n):\n    return n * 2"
+    not_a_list = client.post("/submissions/execute", json={"code": code, "test_cases": '{"input": {"n": 1}}'})
+    assert not_a_list.status_code == 200
+    assert (not_a_list.json()["total"], not_a_list.json()["score"]) == (0, 0.0)
+
+    cases = json.dumps([1, {"input": {"n": 1}, "expected": 2}, "case"])
+    for body in (
+        client.post("/submissions/execute", json={"code": code, "test_cases": cases}).json(),
+        llm_integration.execute_code_safely(code, cases),
+    ):
+        assert (body["passed"], body["failed"], body["total"]) == (1, 2, 3)
+        statuses = [(detail["test"], detail["status"]) for detail in body["details"]]
+        assert statuses == [(1, "error"), (2, "passed"), (3, "error")]
+        assert body["details"][0]["message"] == "Test case must be a JSON object"
+
+
+def test_execute_stream_sends_each_case_then_summary():
+    response = client.post("/submissions/execute/stream", json={
+        "code": "def main(n):\n    return n * 2",
+        "test_cases": [{"input": {"n": 1}, "expected": 2}, {"input": {"n": 2}, "expected": 5}],
+    })
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [
+        (block.split("\n")[0][len("event: "):], json.loads(block.split("\n")[1][len("data: "):]))
+        for block in response.text.strip().split("\n\n")
+    ]
+    assert [event for event, _ in events] == ["case", "case", "summary"]
+    assert sorted(data["status"] for _, data in events[:2]) == ["failed", "passed"]
+    summary = events[2][1]
+    assert (summary["passed"], summary["total"], summary["score"]) == (1, 2, 5.0)
+    assert "details" not in summary
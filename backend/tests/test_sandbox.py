@@ -0,0 +1,234 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from app.services import llm_integration, sandbox
+from app.services.result_cache import ResultCache
+from app.services.sandbox import SandboxPool
+
+ADD_CASES = json.dumps([
+    {"input": {"a": 1, "b": 2}, "expected": 3},
+    {"input": {"a": 2, "b": 2}, "expected": 5},
+])
+
+
+def verdicts(results: dict) -> list:
+    """details without the per-run resource usage, which differs between runs"""
+    return [{k: v for k, v in detail.items() if k != "usage"} for detail in results["details"]]
+
+
+@pytest.fixture(autouse=True)
+def execution_cache(monkeypatch):
+    cache = ResultCache(namespace="test")
+    monkeypatch.setattr(llm_integration, "execution_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = SandboxPool(size=1, max_jobs=3)
+    monkeypatch.setattr(llm_integration, "sandbox_pool", pool)
+    yield pool
+    pool.shutdown()
+
+
+def test_pool_matches_subprocess_results(pool, execution_cache):
+    # Neither path re-indents the code, which would change the string's length
+    code = "TEXT = '''a\nb'''\ndef main(a, b):\n    return a + b + len(TEXT) - 3"
+    pooled = llm_integration.execute_code_safely(code, ADD_CASES)
+    execution_cache.clear()
+    pool.size = 0  # disabled pool falls back to one `python -c` per case
+    assert verdicts(llm_integration.execute_code_safely(code, ADD_CASES)) == verdicts(pooled)
+    assert pooled["passed"] == 1 and pooled["failed"] == 1
+
+
+def test_syntax_errors_are_rejected_before_any_sandbox_runs(pool):
+    result = llm_integration.execute_code_safely("def main(a, b)\n    return a + b", ADD_CASES)
+    assert result["details"] == [] and result["failed"] == 2
+    assert result["error"].endswith("SyntaxError: expected ':'")
+    assert "line 1" in result["error"]
+    assert pool.stats()["started"] == 0
+    assert llm_integration.evaluate_code_output(result) == 0.0
+
+
+def test_pool_reports_errors_like_python_c(pool):
+    result = pool.run("raise ValueError('boom')", timeout=5)
+    expected = subprocess.run([sys.executable, "-c", "raise ValueError('boom')"], capture_output=True, text=True)
+    assert result.returncode == 1
+    assert result.stderr == expected.stderr
+    assert pool.run("import sys\nsys.exit(3)", timeout=5).returncode == 3
+
+
+def test_pool_recycles_after_timeout_and_max_jobs(pool):
+    with pytest.raises(subprocess.TimeoutExpired):
+        pool.run("while True: pass", timeout=0.5)
+    for _ in range(3):
+        assert pool.run("print('ok')", timeout=5).stdout == "ok\n"
+    stats = pool.stats()
+    assert stats["timeouts"] == 1
+    assert stats["recycled"] == 2  # the timed out worker, then one that reached max_jobs
+
+
+def test_suite_loads_module_once_and_times_out_per_case(pool, tmp_path):
+    marker = tmp_path / "loads"
+    code = (
+        f"open({str(marker)!r}, 'a').write('x')\n"
+        "calls = []\n"
+        "def main(a, b):\n"
+        "    calls.append(a)\n"
+        "    while a == 0: pass\n"
+        "    return len(calls)\n"
+    )
+    cases = [{"input": {"a": 0, "b": 0}, "expected": 1}] + [{"input": {"a": 1, "b": 1}, "expected": 1}] * 2
+    details = list(llm_integration.iter_test_results(code, cases, timeout=1))
+
+    assert marker.read_text() == "x"
+    # Each case runs in its own copy of the loaded module, so `calls` never grows past one
+    assert [d["status"] for d in details] == ["timeout", "passed", "passed"]
+
+
+SLEEPY = "import time\ndef main(a, b):\n    time.sleep(0.6)\n    return a + b"
+SLEEPY_CASES = [{"input": {"a": 1, "b": 2}, "expected": 3}] * 3
+
+
+def test_cases_fan_out_across_sandboxes(monkeypatch):
+    pool = SandboxPool(size=3, max_jobs=10)
+    monkeypatch.setattr(llm_integration, "sandbox_pool", pool)
+    try:
+        pool.start()
+        started = time.monotonic()
+        result = llm_integration.execute_code_safely(SLEEPY, json.dumps(SLEEPY_CASES))
+        assert time.monotonic() - started < 1.5
+        assert result["passed"] == 3
+        assert [d["test"] for d in result["details"]] == [1, 2, 3]
+    finally:
+        pool.shutdown()
+
+
+def test_submission_deadline_cancels_remaining_cases(pool):
+    result = llm_integration.execute_code_safely(SLEEPY, json.dumps(SLEEPY_CASES), submission_timeout=1.0)
+    assert [d["status"] for d in result["details"]] == ["passed", "timeout", "timeout"]
+    assert result["details"][2]["message"] == "Submission time limit exceeded"
+
+
+def test_cases_run_under_resource_limits_and_report_usage(pool, monkeypatch):
+    monkeypatch.setattr(sandbox, "SANDBOX_MEMORY_MB", 256)
+    monkeypatch.setattr(sandbox, "SANDBOX_CPU_SECONDS", 1)
+    code = (
+        "def main(a, b):\n"
+        "    if a == 1:\n"
+        "        return len(bytearray(512 * 1024 * 1024))\n"
+        "    if a == 2:\n"
+        "        while True: pass\n"
+        "    return a + b"
+    )
+    cases = [{"input": {"a": a, "b": 1}, "expected": a + 1} for a in (0, 1, 2)]
+    result = llm_integration.execute_code_safely(code, json.dumps(cases), timeout=5)
+
+    # MemoryError is caught by the test script like any exception from main()
+    assert [d["status"] for d in result["details"]] == ["passed", "failed", "error"]
+    assert result["details"][1]["actual"] is None
+    assert result["details"][2]["message"] == "CPU time limit exceeded"
+    for detail in result["details"]:
+        assert set(detail["usage"]) == {"wall_ms", "cpu_ms", "peak_rss_kb"}
+        assert detail["usage"]["peak_rss_kb"] > 0
+    assert result["details"][2]["usage"]["cpu_ms"] >= 900
+    assert result["usage"]["cpu_ms"] >= result["details"][2]["usage"]["cpu_ms"]
+
+
+def test_one_off_sandboxes_get_the_limits_too(monkeypatch):
+    pool = SandboxPool(size=0)
+    monkeypatch.setattr(llm_integration, "sandbox_pool", pool)
+    monkeypatch.setattr(sandbox, "SANDBOX_CPU_SECONDS", 1)
+    spin = "def main(a, b):\n    while True: pass"
+    cases = json.dumps([{"input": {"a": 1, "b": 1}, "expected": 2}])
+
+    threaded = llm_integration.execute_code_safely(spin, cases, timeout=5)
+    awaited = asyncio.run(llm_integration.execute_code_async(spin + "\n# async", cases, timeout=5))
+    for result in (threaded, awaited):
+        assert result["details"][0]["message"] == "CPU time limit exceeded"
+        assert result["details"][0]["usage"]["cpu_ms"] >= 900
+
+
+def test_repeated_submissions_are_served_from_cache(pool, execution_cache):
+    code = "def main(a, b):\n    return a + b\n"
+    first = llm_integration.execute_code_safely(code, ADD_CASES)
+    # Same code modulo line endings and trailing blank lines
+    second = llm_integration.execute_code_safely("def main(a, b):\r\n    return a + b\r\n\r\n  ", ADD_CASES)
+
+    assert first["cached"] is False and second["cached"] is True
+    # Including the usage of the run that produced them
+    assert second["details"] == first["details"]
+    assert llm_integration.execute_code_safely(code, ADD_CASES, timeout=3)["cached"] is False
+
+    # Timeouts depend on load, so they are never reused
+    llm_integration.execute_code_safely(SLEEPY, json.dumps(SLEEPY_CASES), timeout=0.2)
+    assert llm_integration.execute_code_safely(SLEEPY, json.dumps(SLEEPY_CASES), timeout=0.2)["cached"] is False
+    stats = execution_cache.stats()
+    assert stats["hits"] == 1 and stats["entries"] == 2
+
+
+def test_async_execution_matches_and_kills_on_cancel(pool, tmp_path):
+    pid_file = tmp_path / "pid"
+    hang = f"import os, time\ndef main(a, b):\n    open({str(pid_file)!r}, 'w').write(str(os.getpid()))\n    time.sleep(30)"
+
+    async def scenario():
+        code = "def main(a, b):\n    return a + b"
+        assert verdicts(await llm_integration.execute_code_async(code, ADD_CASES)) == verdicts(
+            llm_integration.execute_code_safely(code, ADD_CASES)
+        )
+
+        task = asyncio.ensure_future(llm_integration.execute_code_async(hang, ADD_CASES))
+        while not pid_file.exists():
+            await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        await asyncio.sleep(0.2)
+
+    asyncio.run(scenario())
+    assert not _running(int(pid_file.read_text()))
+    # Both ran on pooled workers; the cancelled one was killed and replaced
+    stats = pool.stats()
+    assert (stats["jobs"], stats["recycled"], stats["idle"]) == (2, 1, 1)
+
+
+def test_sync_and_async_runs_share_one_sandbox_cap(monkeypatch):
+    pool = SandboxPool(size=0)
+    pool._fallback_capacity = 1
+    pool._fallback_slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(llm_integration, "sandbox_pool", pool)
+    case = json.dumps(SLEEPY_CASES[:1])
+
+    async def scenario():
+        started = time.monotonic()
+        threaded = asyncio.get_running_loop().run_in_executor(
+            None, llm_integration.execute_code_safely, SLEEPY, case
+        )
+        awaited = llm_integration.execute_code_async(SLEEPY + "  # async", case)
+        results = await asyncio.gather(threaded, awaited)
+        return results, time.monotonic() - started
+
+    results, elapsed = asyncio.run(scenario())
+    assert [r["passed"] for r in results] == [1, 1]
+    # One slot between them, so the two sandboxes ran one after the other
+    assert elapsed >= 1.2
+
+
+def _running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # Killed orphans may linger as zombies until init reaps them
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from app.services.evaluation import SIMILARITY_MODEL_NAME
+from app.services.inference_backends import load_similarity_encoder
+
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("onnxruntime")
+
+PAIRS = [
+    ("A golden sunset over a beach with palm trees", "A breathtaking golden sunset over a tropical beach with palm trees silhouetted against the orange and purple sky"),
+    ("def is_palindrome(s): return s == s[::-1]", "def is_palindrome(s): cleaned = join(c.lower() for c in s if c.isalnum()) return cleaned == cleaned[::-1]"),
+    ("Welcome to the app! Set your first goal today.", "A friendly, motivating welcome email that introduces app features and encourages the user to set their first fitness goal"),
+    ("Quarterly tax filing instructions", "An enchanted forest path with glowing mushrooms and fireflies"),
+]
+
+# Scores are on a 0-10 scale; int8 weights may move them slightly
+MAX_SCORE_DRIFT = {"onnx": 0.05, "onnx-int8": 0.3}
+
+
+def scores(encoder):
+    texts = [text for pair in PAIRS for text in pair]
+    embeddings = np.asarray(encoder.encode(texts), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return np.clip(np.sum(embeddings[0::2] * embeddings[1::2], axis=1) * 10, 0, 10)
+
+
+@pytest.fixture(scope="module")
+def torch_scores():
+    try:
+        encoder, backend = load_similarity_encoder(SIMILARITY_MODEL_NAME, "torch")
+    except Exception as e:  # Model not cached and no network
+        pytest.skip(f"Similarity model unavailable: {e}")
+    return scores(encoder)
+
+
+@pytest.mark.parametrize("quantize", [False, True])
+def test_onnx_backend_score_parity(torch_scores, quantize):
+    encoder, backend = load_similarity_encoder(SIMILARITY_MODEL_NAME, "onnx", quantize)
+    if backend == "torch":
+        pytest.skip("ONNX export unavailable in this environment")
+    drift = np.abs(scores(encoder) - torch_scores)
+    assert drift.max() <= MAX_SCORE_DRIFT[backend]